@@ -0,0 +1,348 @@
+# -*- coding: UTF-8 -*-
+
+# chart-to-sm.py benchmarks
+# Copyright (C) 2021 shockdude
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Times each stage of the converter on synthetic charts, e.g.
+#   python bench.py -o new.json --baseline old.json --threshold 0.1
+# or checks that conversions which must give the same simfile do, with
+#   python bench.py --check
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+import codecs
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import mido_sysexhack as mido
+
+# the converter's file name isn't a valid module name, so load it by path
+converter_spec = importlib.util.spec_from_file_location("chart_to_sm", os.path.join(BENCH_DIR, "chart-to-sm.py"))
+converter = importlib.util.module_from_spec(converter_spec)
+converter_spec.loader.exec_module(converter)
+
+# note density of each difficulty relative to the requested density, in DIFFMAPPINGS order
+DIFF_DENSITIES = (1.0, 0.75, 0.5, 0.3)
+
+# beat subdivisions notes are placed on: 16ths, triplets & 32nds
+NOTE_GRIDS = (4, 4, 4, 3, 6, 8)
+
+# a .chart resolution other than the default of 192, so a chart whose Resolution is lost converts differently
+CHECK_RESOLUTION = 480
+
+# beats before the last note of the sparse chart checked for the same output from both engines
+SPARSE_CHART_BEATS = 1000003
+
+MID_TRACK_NAME = "PART GUITAR"
+SONG_INI_TEXT = "[song]\nname = Benchmark\nartist = chart-to-sm\ncharter = bench.py\ndiff_guitar = 4\n"
+
+def generate_tempos(rng, params):
+	# [(tick, bpm)] starting at tick 0, with tempo_changes more at random beats
+	beats = params["measures"] * 4
+	tempos = [(0, 120.0)]
+	for beat in sorted(rng.sample(range(1, beats), min(params["tempo_changes"], beats - 1))):
+		tempos.append((beat * params["resolution"], round(rng.uniform(80, 220), 3)))
+	return tempos
+
+def generate_notes(rng, params, density):
+	# [(tick, lanes, length)] sorted by tick, lanes are 0-4 or (5,) for an open note
+	# sustains never overlap the next note, so the same notes make sense in .chart & .mid
+	resolution = params["resolution"]
+	song_length = params["measures"] * 4 * resolution
+	ticks = set()
+	for i in range(int(params["measures"] * 4 * density)):
+		grid = rng.choice(NOTE_GRIDS)
+		ticks.add(resolution * rng.randrange(params["measures"] * 4 * grid) // grid)
+	ticks = sorted(ticks)
+
+	min_sustain = int(round(resolution * 4 / converter.SUSTAIN_THRESH))
+	notes = []
+	for tick, next_tick in zip(ticks, ticks[1:] + [song_length]):
+		if rng.random() < params["open_ratio"]:
+			lanes = (5,)
+		else:
+			lanes = tuple(sorted(rng.sample(range(5), rng.choice((1, 1, 1, 2, 2, 3)))))
+		length = 0
+		if next_tick - tick > min_sustain and rng.random() < params["sustain_ratio"]:
+			length = rng.randint(min_sustain, next_tick - tick)
+		notes.append((tick, lanes, length))
+	return notes
+
+def generate_song(params):
+	# generate tempos & the notes of every difficulty with a seeded rng
+	rng = random.Random(params["seed"])
+	tempos = generate_tempos(rng, params)
+	diff_notes = [generate_notes(rng, params, params["density"] * diff_density) for diff_density in DIFF_DENSITIES]
+	return tempos, diff_notes
+
+def song_to_chart(params, tempos, diff_notes):
+	# write a notes.chart, returns its bytes
+	lines = ["[Song]", "{", "  Name = \"Benchmark\"", "  Resolution = {}".format(params["resolution"]), "}"]
+	lines += ["[SyncTrack]", "{", "  0 = TS 4"]
+	lines += ["  {} = B {}".format(tick, int(round(bpm * 1000))) for tick, bpm in tempos]
+	lines += ["}", "[Events]", "{", "}"]
+	for diffmap, notes in zip(converter.DIFFMAPPINGS, diff_notes):
+		lines += [diffmap[0], "{"]
+		for tick, lanes, length in notes:
+			for lane in lanes:
+				lines.append("  {} = N {} {}".format(tick, 7 if lane == 5 else lane, length))
+		lines.append("}")
+	return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+def song_to_mid(params, tempos, diff_notes):
+	# write a notes.mid, returns its bytes
+	mid = mido.MidiFile(ticks_per_beat=params["resolution"])
+	tempo_track = mid.add_track()
+	current_tick = 0
+	for tick, bpm in tempos:
+		tempo_track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=tick - current_tick))
+		current_tick = tick
+
+	# (tick, order, message) events, note offs go before sysex & note ons on the same tick
+	events = []
+	tap_length = max(1, params["resolution"] // 8)
+	for diffmap, notes in zip(converter.MIDDIFFMAPPINGS, diff_notes):
+		for (tick, lanes, length), next_tick in zip(notes, [note[0] for note in notes[1:]] + [None]):
+			if lanes == (5,):
+				# an open note is a green note with an open sysex on the same tick
+				events.append((tick, 1, mido.Message("sysex", data=diffmap[2])))
+				lanes = (0,)
+			if length > 0:
+				end_tick = tick + length
+			elif next_tick != None:
+				end_tick = tick + min(tap_length, next_tick - tick)
+			else:
+				end_tick = tick + tap_length
+			for lane in lanes:
+				events.append((tick, 2, mido.Message("note_on", note=diffmap[1] + lane, velocity=100)))
+				events.append((end_tick, 0, mido.Message("note_on", note=diffmap[1] + lane, velocity=0)))
+	events.sort(key=lambda event: event[:2])
+
+	notes_track = mid.add_track(MID_TRACK_NAME)
+	current_tick = 0
+	for tick, order, msg in events:
+		notes_track.append(msg.copy(time=tick - current_tick))
+		current_tick = tick
+
+	mid_file = io.BytesIO()
+	mid.save(file=mid_file)
+	return mid_file.getvalue()
+
+def time_stage(stage, setup, repeat):
+	# run stage(setup()) repeat times, timing only the stage
+	times = []
+	for i in range(repeat):
+		args = setup()
+		start = time.perf_counter()
+		stage(args)
+		times.append(time.perf_counter() - start)
+	return {"min": min(times), "median": statistics.median(times), "repeat": repeat}
+
+def render(sm_chunks):
+	# consume note blocks, as writing the simfile would
+	for chunks in sm_chunks:
+		''.join(chunks)
+
+def chart_stages(chart, use_numpy):
+	# (name, stage, setup) of each .chart stage
+	chart_data = converter.parse_chart(converter.read_text(chart))
+	measure_length = chart_data["resolution"] * 4
+	get_notes = converter.chart_get_notes_numpy if use_numpy else converter.chart_get_notes
+	def get_all_notes(chart_notes):
+		return [get_notes(chart_notes, diffmap, 1, measure_length) for diffmap in converter.DIFFMAPPINGS]
+	return (("check_encoding", converter.check_encoding, lambda: chart),
+			("parse_chart", lambda data: converter.parse_chart(converter.read_text(data)), lambda: chart),
+			("chart_get_notes", get_all_notes, lambda: chart_data["notes"]),
+			("output_sm", render, lambda: get_all_notes(chart_data["notes"])))
+
+def mid_stages(mid_bytes, use_numpy):
+	# (name, stage, setup) of each .mid stage
+	mid = mido.MidiFile(file=io.BytesIO(mid_bytes))
+	track_notes = [track for track in mid.tracks if track.name == MID_TRACK_NAME][0]
+	measure_length = mid.ticks_per_beat * 4
+	def output_notes(args):
+		all_notes, last_note = args
+		if use_numpy:
+			render(converter.output_sm_numpy(*converter.notes_to_arrays(notes), last_note, measure_length, diffmap[0], 1)
+					for diffmap, notes in zip(converter.MIDDIFFMAPPINGS, all_notes))
+		else:
+			render(converter.output_sm(notes, last_note, measure_length, diffmap[0], 1)
+					for diffmap, notes in zip(converter.MIDDIFFMAPPINGS, all_notes))
+	return (("MidiFile", lambda data: mido.MidiFile(file=io.BytesIO(data)), lambda: mid_bytes),
+			("MidiFile_tempomap", lambda data: mido.MidiFile(file=io.BytesIO(data), load_tracks=lambda i, name: i == 0), lambda: mid_bytes),
+			("mid_get_notes", lambda track: converter.mid_get_notes(track, measure_length), lambda: track_notes),
+			("output_sm", output_notes, lambda: converter.mid_get_notes(track_notes, measure_length)))
+
+def handle_file_stage(chart_path):
+	# convert a chart folder end to end
+	if converter.handle_file(chart_path) != 0:
+		raise RuntimeError("failed to convert {}".format(chart_path))
+
+def run_benchmarks(params, repeat, use_numpy):
+	# returns {"<chart type>/<stage>": timings}
+	tempos, diff_notes = generate_song(params)
+	charts = {"chart": song_to_chart(params, tempos, diff_notes), "mid": song_to_mid(params, tempos, diff_notes)}
+	results = {}
+	with tempfile.TemporaryDirectory() as temp_dir:
+		for chart_type, chart in charts.items():
+			if chart_type == "chart":
+				stages = chart_stages(chart, use_numpy)
+			else:
+				stages = mid_stages(chart, use_numpy)
+
+			# a whole chart folder for handle_file
+			chart_dir = os.path.join(temp_dir, chart_type)
+			os.mkdir(chart_dir)
+			chart_path = os.path.join(chart_dir, converter.NOTES_NAME + "." + chart_type)
+			with open(chart_path, "wb") as chart_file:
+				chart_file.write(chart)
+			with open(os.path.join(chart_dir, converter.SONG_INI), "w", encoding="utf-8") as song_ini:
+				song_ini.write(SONG_INI_TEXT)
+			open(os.path.join(chart_dir, converter.SONG_FILES[0]), "wb").close()
+			stages += (("handle_file", handle_file_stage, lambda: chart_path),)
+
+			# the converter's messages would end up in the results
+			with contextlib.redirect_stdout(io.StringIO()):
+				for name, stage, setup in stages:
+					results["{}/{}".format(chart_type, name)] = dict(time_stage(stage, setup, repeat), bytes=len(chart))
+	return results
+
+def encoding_variants(chart):
+	# the same .chart text in every encoding the converter detects
+	text = chart.decode("utf-8")
+	return (("utf-8 bom", codecs.BOM_UTF8 + chart),
+			("utf-16-le", codecs.BOM_UTF16_LE + text.encode("utf-16-le")),
+			("utf-16-be", codecs.BOM_UTF16_BE + text.encode("utf-16-be")))
+
+def sparse_chart(params):
+	# a .chart with a single note far past its start, so nearly every measure is empty
+	lines = ["[Song]", "{", "  Resolution = {}".format(params["resolution"]), "}", "[SyncTrack]", "{", "  0 = B 120000", "}",
+		converter.DIFFMAPPINGS[0][0], "{", "  0 = N 0 0", "  {} = N 1 {}".format(params["resolution"] * SPARSE_CHART_BEATS, params["resolution"]), "}"]
+	return ("\n".join(lines) + "\n").encode("utf-8")
+
+def run_checks(params):
+	# convert the synthetic charts in ways that must give identical simfiles, returns the names of failed checks
+	params = dict(params, resolution=CHECK_RESOLUTION)
+	tempos, diff_notes = generate_song(params)
+	charts = ((".chart", song_to_chart(params, tempos, diff_notes)), (".mid", song_to_mid(params, tempos, diff_notes)),
+		("sparse .chart", sparse_chart(params)))
+	song_ini = SONG_INI_TEXT.encode("utf-8")
+	def convert(chart, chart_ext):
+		return converter.convert_chart(chart, chart_ext, song_ini, converter.SONG_FILES[0])
+
+	# (name, expected simfile, simfile)
+	checks = []
+	with contextlib.redirect_stdout(io.StringIO()):
+		for name, variant in encoding_variants(charts[0][1]):
+			checks.append((".chart " + name, convert(charts[0][1], converter.CHART_EXT), convert(variant, converter.CHART_EXT)))
+		if converter.numpy != None:
+			for name, chart in charts:
+				chart_ext = converter.MID_EXT if name == ".mid" else converter.CHART_EXT
+				converter.set_numpy_engine(False)
+				python_text = convert(chart, chart_ext)
+				converter.set_numpy_engine(True)
+				checks.append((name + " numpy engine", python_text, convert(chart, chart_ext)))
+
+	failed = []
+	for name, expected, sm_text in checks:
+		if expected == None or sm_text != expected:
+			failed.append(name)
+		print("{:<28} {}".format(name, "FAILED" if name in failed else "ok"), file=sys.stderr)
+	return failed
+
+def compare_results(results, baseline, threshold):
+	# print each stage against the baseline, returns the stages slower by more than threshold
+	regressions = []
+	print("{:<28} {:>10} {:>10} {:>8}".format("stage", "baseline", "current", "change"), file=sys.stderr)
+	for name, timings in results.items():
+		if name not in baseline:
+			print("{:<28} {:>10} {:>10.4f} {:>8}".format(name, "-", timings["min"], "new"), file=sys.stderr)
+			continue
+		base_time = baseline[name]["min"]
+		change = timings["min"] / base_time - 1 if base_time > 0 else 0
+		flag = ""
+		if change > threshold:
+			regressions.append(name)
+			flag = "  REGRESSION"
+		print("{:<28} {:>10.4f} {:>10.4f} {:>+7.1%}{}".format(name, base_time, timings["min"], change, flag), file=sys.stderr)
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark each stage of chart-to-sm on synthetic charts")
+	parser.add_argument("-o", "--output", help="write the results JSON here instead of stdout")
+	parser.add_argument("--baseline", help="results JSON to compare against")
+	parser.add_argument("--check", action="store_true", help="check that equivalent conversions give identical simfiles instead of timing")
+	parser.add_argument("--threshold", type=float, default=0.10, help="fail if a stage is this much slower than the baseline (default 0.10 = 10%%)")
+	parser.add_argument("--repeat", type=int, default=5, help="times to run each stage, the fastest run is compared (default 5)")
+	parser.add_argument("--engine", choices=("auto", "python", "numpy"), default="auto", help="note engine to benchmark (default: numpy if installed)")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--resolution", type=int, default=192, help="ticks per beat")
+	parser.add_argument("--measures", type=int, default=200, help="song length in 4/4 measures")
+	parser.add_argument("--density", type=float, default=4.0, help="expert notes per beat, lower difficulties get fewer")
+	parser.add_argument("--sustain-ratio", type=float, default=0.2, help="chance of a note being a sustain")
+	parser.add_argument("--tempo-changes", type=int, default=8)
+	parser.add_argument("--open-ratio", type=float, default=0.05, help="chance of a note being an open note")
+	args = parser.parse_args()
+
+	if args.engine == "numpy" and converter.numpy == None:
+		parser.error("numpy isn't installed")
+	use_numpy = args.engine != "python" and converter.numpy != None
+	# end to end conversions use the same engine
+	converter.set_numpy_engine(use_numpy)
+
+	params = {"seed": args.seed, "resolution": args.resolution, "measures": args.measures, "density": args.density,
+			"sustain_ratio": args.sustain_ratio, "tempo_changes": args.tempo_changes, "open_ratio": args.open_ratio}
+	if args.check:
+		failed = run_checks(params)
+		if len(failed) > 0:
+			print("{} check(s) failed".format(len(failed)), file=sys.stderr)
+		sys.exit(1 if len(failed) > 0 else 0)
+	report = {"converter_version": converter.VERSION,
+			"python": platform.python_version(),
+			"engine": "numpy" if use_numpy else "python",
+			"params": params,
+			"results": run_benchmarks(params, args.repeat, use_numpy)}
+
+	if args.output != None:
+		with open(args.output, "w", encoding="utf-8") as output_file:
+			json.dump(report, output_file, indent=2)
+	else:
+		json.dump(report, sys.stdout, indent=2)
+		print()
+
+	regressions = []
+	if args.baseline != None:
+		with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+			baseline = json.load(baseline_file)
+		if baseline["params"] != params:
+			print("Warning: baseline was generated with different parameters", file=sys.stderr)
+		regressions = compare_results(report["results"], baseline["results"], args.threshold)
+		if len(regressions) > 0:
+			print("{} stage(s) regressed by more than {:.0%}".format(len(regressions), args.threshold), file=sys.stderr)
+	sys.exit(1 if len(regressions) > 0 else 0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+
+# chart-to-sm.py client
+# Copyright (C) 2021 shockdude
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Sends charts to a converter started with `chart-to-sm.py --serve ADDRESS`
+# Only uses the standard library, so it starts quickly
+
+import os
+import sys
+import json
+import socket
+import struct
+import argparse
+
+# same framing as chart-to-sm.py: 4-byte big-endian header length, JSON header, header["size"] bytes of payload
+SERVER_HEADER = struct.Struct(">I")
+
+def connect(address):
+	# host:port, or a UNIX socket path
+	host, sep, port = address.rpartition(":")
+	if port.isdigit():
+		return socket.create_connection((host or "127.0.0.1", int(port)))
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.connect(address)
+	return sock
+
+def send_message(sock, header, payload=b""):
+	header = dict(header, size=len(payload))
+	header_bytes = json.dumps(header).encode("utf-8")
+	sock.sendall(SERVER_HEADER.pack(len(header_bytes)) + header_bytes + payload)
+
+def recv_exactly(sock, size):
+	data = bytearray()
+	while len(data) < size:
+		chunk = sock.recv(min(size - len(data), 1 << 20))
+		if len(chunk) == 0:
+			raise EOFError("connection closed")
+		data += chunk
+	return bytes(data)
+
+def recv_message(sock):
+	header_size, = SERVER_HEADER.unpack(recv_exactly(sock, SERVER_HEADER.size))
+	header = json.loads(recv_exactly(sock, header_size).decode("utf-8"))
+	return header, recv_exactly(sock, header.get("size", 0))
+
+def main():
+	parser = argparse.ArgumentParser(description="Convert charts with a running chart-to-sm.py --serve")
+	parser.add_argument("address", help="the server's UNIX socket path or localhost:PORT")
+	parser.add_argument("charts", nargs="*", help=".chart or .mid files, converted to a notes.ssc next to each")
+	parser.add_argument("-o", "--output", help="send a single chart's bytes & write the .ssc here instead ('-' for stdout)")
+	parser.add_argument("--song-ini", help="song.ini to send with -o")
+	parser.add_argument("--song-file", help="audio file name to use with -o")
+	parser.add_argument("--shutdown", action="store_true", help="stop the server")
+	# options can come before or after the charts, like -o out.ssc notes.mid
+	args = parser.parse_intermixed_args()
+
+	failed = 0
+	with connect(args.address) as sock:
+		if args.output != None:
+			if len(args.charts) != 1:
+				parser.error("-o needs exactly one chart")
+			request = {"command": "convert_bytes", "chart_ext": os.path.splitext(args.charts[0])[1], "song_file": args.song_file}
+			if args.song_ini != None:
+				with open(args.song_ini, "rb") as song_ini:
+					request["song_ini"] = song_ini.read().decode("latin-1")
+			with open(args.charts[0], "rb") as chart:
+				send_message(sock, request, chart.read())
+			reply, sm_bytes = recv_message(sock)
+			sys.stderr.write(reply["messages"])
+			if reply["status"] == 0:
+				if args.output == "-":
+					sys.stdout.buffer.write(sm_bytes)
+				else:
+					with open(args.output, "wb") as ssc_file:
+						ssc_file.write(sm_bytes)
+			else:
+				failed += 1
+		else:
+			for chart in args.charts:
+				send_message(sock, {"command": "convert", "path": os.path.abspath(chart)})
+				reply, payload = recv_message(sock)
+				sys.stdout.write(reply["messages"])
+				if reply["status"] != 0:
+					print("Error: failed to convert {}".format(chart))
+					failed += 1
+		if args.shutdown:
+			send_message(sock, {"command": "shutdown"})
+			recv_message(sock)
+	sys.exit(1 if failed > 0 else 0)
+
+if __name__ == "__main__":
+	main()
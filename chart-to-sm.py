@@ -22,10 +22,36 @@ import re
 import math
 import os
 import sys
+import time
+import contextlib
+import threading
+import queue
 import traceback
 import codecs
+import io
+import itertools
+import hashlib
+import json
+import argparse
+import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import socket
+import socketserver
+import struct
+import array
 # hacked mido 1.2.9 to support sysex data bytes > 127, used for tap notes
 import mido_sysexhack as mido
+# optional, vectorizes note processing when available
+try:
+	import numpy
+except ImportError:
+	numpy = None
+# optional, measures batch worker memory where /proc isn't available
+try:
+	import psutil
+except ImportError:
+	psutil = None
 
 VERSION = "v0.3"
 
@@ -33,6 +59,34 @@ CHART_EXT = ".chart"
 MID_EXT = ".mid"
 NOTES_NAME = "notes"
 SONG_INI = "song.ini"
+SSC_NAME = "notes.ssc"
+
+# number of charts sent to a batch worker at a time
+BATCH_CHUNK_SIZE = 8
+
+# minimum seconds between batch progress updates, on a console & in a log
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LOG_INTERVAL = 10
+
+# charts each batch worker can have read ahead or waiting to be written in a pipelined batch
+PIPELINE_QUEUE_PER_WORKER = 4
+
+# seconds between saves of a job file's checkpoint
+CHECKPOINT_INTERVAL = 30
+
+# seconds between checks of batch workers' time & memory limits
+WORKER_POLL_INTERVAL = 0.1
+
+# default size limit of the conversion cache, in bytes
+CACHE_MAX_SIZE = 1000000000
+# stores between each process's checks of the cache size
+CACHE_PRUNE_EVERY = 256
+
+# server messages are a 4-byte big-endian header length, a JSON header & header["size"] bytes of payload
+SERVER_HEADER = struct.Struct(">I")
+
+# fingerprints of converted chart folders, stored at the root of a scanned library
+MANIFEST_NAME = "chart-to-sm-manifest.json"
 
 SUSTAIN_THRESH = 16
 
@@ -40,11 +94,32 @@ NUM_COLUMNS = 6
 
 SONG_FILES = ("song.ogg", "guitar.ogg", "song.mp3", "guitar.mp3")
 
+# files in a chart folder the converter looks at
+FOLDER_FILES = (NOTES_NAME+MID_EXT, NOTES_NAME+CHART_EXT, SONG_INI, SSC_NAME) + SONG_FILES
+
+# instruments that can be converted, as (name, .chart section suffix, .mid track names in order of preference, song.ini difficulty)
+INSTRUMENTS = (("guitar", "Single", ("PART GUITAR", "T1 GEMS"), "diff_guitar"),
+				("rhythm", "DoubleRhythm", ("PART RHYTHM",), "diff_rhythm"),
+				("bass", "DoubleBass", ("PART BASS",), "diff_bass"),
+				("coop", "DoubleGuitar", ("PART GUITAR COOP",), "diff_guitar_coop"))
+INSTRUMENT_NAMES = tuple(instrument[0] for instrument in INSTRUMENTS)
+# the instruments a .mid's single part is converted from without a mapping, in order of preference
+SINGLE_PART_INSTRUMENTS = ("guitar", "rhythm", "bass")
+
+# stepmania outfox 4.9.6 currently only supports 1 open-note instrument: bass-six
+# so unless set_instrument_stepstypes maps instruments to STEPSTYPEs, only 1 guitar part is converted, as this
+DEFAULT_STEPSTYPE = "bass-six"
+
 # mappings for difficulty names from CH to SM
-DIFFMAPPINGS = (("[ExpertSingle]", "Challenge"),
-				("[HardSingle]", "Hard"),
-				("[MediumSingle]", "Medium"),
-				("[EasySingle]", "Easy"))
+CHART_DIFFS = (("Expert", "Challenge"),
+				("Hard", "Hard"),
+				("Medium", "Medium"),
+				("Easy", "Easy"))
+
+# .chart sections of each instrument's difficulties, e.g. [ExpertDoubleBass]
+INSTRUMENT_DIFFMAPPINGS = {instrument[0]: tuple(("[{}{}]".format(ch_diff, instrument[1]), sm_diff) for ch_diff, sm_diff in CHART_DIFFS)
+							for instrument in INSTRUMENTS}
+DIFFMAPPINGS = INSTRUMENT_DIFFMAPPINGS["guitar"]
 				
 # MIDI green notes & open sysex on/off per difficulty
 # open sysex off currently unused, but good to document
@@ -53,9 +128,72 @@ MIDDIFFMAPPINGS = (("Challenge", 96, (80,83,0,0,3,1,1), (80,83,0,0,3,1,0)),
 					("Medium", 72, (80,83,0,0,1,1,1), (80,83,0,0,1,1,0)),
 					("Easy", 60, (80,83,0,0,0,1,1), (80,83,0,0,0,1,0)))
 
+# lookups from MIDI note number to (difficulty index, lane) & from open sysex to difficulty index
+MID_NOTE_LANES = {diffmap[1] + lane: (diff_index, lane) for diff_index, diffmap in enumerate(MIDDIFFMAPPINGS) for lane in range(5)}
+MID_OPEN_SYSEX = {diffmap[2]: diff_index for diff_index, diffmap in enumerate(MIDDIFFMAPPINGS)}
+
+# kinds of .mid note events kept in the intermediate representation
+MID_NOTE_OFF = 0
+MID_NOTE_ON = 1
+MID_OPEN = 2
+
+# sidecar files holding a chart's intermediate representation, e.g. notes.chart.ir
+IR_SIDECAR_EXT = ".ir"
+IR_MAGIC = b"C2SIR"
+IR_FORMAT = 2
+# sidecars start with IR_MAGIC, a 4-byte big-endian header length & a JSON header
+IR_HEADER = struct.Struct(">I")
+
+# sidecar files holding a .chart's section index, e.g. notes.chart.idx
+CHART_INDEX_EXT = ".idx"
+CHART_INDEX_FORMAT = 1
+
 # valid notes: GRYBO and open
 VALID_NOTES = (0, 1, 2, 3, 4, 7)
 
+# profiling hooks, each called as hook(stage, stats) when an instrumented stage finishes
+# stats has the stage's "wall" & "cpu" seconds plus its counts, e.g. "bytes_read" or "notes"
+# the "chart" stage wraps a whole handle_file conversion & comes after the stages inside it
+PROFILE_HOOKS = []
+
+# .chart line patterns
+CHART_RESOLUTION_RE = re.compile(r"Resolution = (\d+)")
+CHART_BPM_RE = re.compile(r"(\d+) = B (\d+)")
+CHART_NOTE_RE = re.compile(r"(\d+) = N (\d) (\d+)")
+# a .chart section header line in raw bytes, e.g. [ExpertSingle]
+CHART_SECTION_RE = re.compile(rb"^(?:\xef\xbb\xbf)?[ \t]*(\[[^\]\r\n]*\])[ \t]*\r?$", re.M)
+
+# a row of notes is packed into an int, 2 bits per SM column:
+# 0 is empty, 1 is a note, 2 is a sustain start & 3 is a sustain end
+LANE_BITS = 2
+LANE_MASK = (1 << LANE_BITS) - 1
+
+# precomputed SM text for every packed row
+ROW_DIGITS = ("0", "1", "2", "3")
+ROW_STRINGS = tuple(''.join(ROW_DIGITS[(row >> (lane * LANE_BITS)) & LANE_MASK] for lane in range(NUM_COLUMNS)) + "\n"
+					for row in range(1 << (NUM_COLUMNS * LANE_BITS)))
+EMPTY_ROW = ROW_STRINGS[0]
+EMPTY_ROW_MEASURE = EMPTY_ROW + ",\n"
+EMPTY_ROW_LAST_MEASURE = EMPTY_ROW + ";\n"
+if numpy != None:
+	NUMPY_MEASURE_CHUNK = 256
+	# each row's text as a single fixed-size element, so rendering is one gather
+	ROW_BYTES = numpy.frombuffer(''.join(ROW_STRINGS).encode("ascii"), dtype=numpy.dtype((numpy.void, len(EMPTY_ROW))))
+
+# whether notes are processed with numpy when it's installed, both engines write the same simfiles
+numpy_engine = numpy != None
+
+def set_numpy_engine(enabled):
+	global numpy_engine
+	numpy_engine = enabled and numpy != None
+
+def get_lane(row, lane):
+	return (row >> (lane * LANE_BITS)) & LANE_MASK
+
+def set_lane(row, lane, value):
+	shift = lane * LANE_BITS
+	return (row & ~(LANE_MASK << shift)) | (value << shift)
+
 # compute the maximum note index step per measure
 def measure_gcd(num_set, measure_length):
 	d = measure_length
@@ -66,91 +204,244 @@ def measure_gcd(num_set, measure_length):
 	return d;
 
 # based on https://stackoverflow.com/a/65841914
-def check_encoding(infile):
-	with open(infile, "rb") as f:
-		beginning = f.read(4)
-		# The order of these if-statements is important
-		# otherwise UTF32 LE may be detected as UTF16 LE as well
-		if beginning == codecs.BOM_UTF32_LE:
-			return "utf_32_be"
-		elif beginning == codecs.BOM_UTF32_BE:
-			return "utf_32_le"
-		elif beginning[0:3] == codecs.BOM_UTF8:
-			return "utf_8_sig"
-		elif beginning[0:2] == codecs.BOM_UTF16_LE:
-			return "utf_16_le"
-		elif beginning[0:2] == codecs.BOM_UTF16_BE:
-			return "utf_16_be"
-	# check if utf-8
+def check_bom(data):
+	beginning = data[0:4]
+	# The order of these if-statements is important
+	# otherwise UTF32 LE may be detected as UTF16 LE as well
+	if beginning == codecs.BOM_UTF32_LE:
+		return "utf_32_be"
+	elif beginning == codecs.BOM_UTF32_BE:
+		return "utf_32_le"
+	elif beginning[0:3] == codecs.BOM_UTF8:
+		return "utf_8_sig"
+	elif beginning[0:2] == codecs.BOM_UTF16_LE:
+		return "utf_16_le"
+	elif beginning[0:2] == codecs.BOM_UTF16_BE:
+		return "utf_16_be"
+	return None
+
+def decode_text(data):
+	# detect the encoding of raw bytes & decode them in the same step, returns (text, encoding)
+	encoding = check_bom(data)
+	if encoding != None:
+		return data.decode(encoding), encoding
+	# check if utf-8, keeping the decoded text if it is
+	try:
+		return data.decode("utf-8"), "utf-8"
+	except UnicodeDecodeError:
+		return data.decode("cp1252"), "cp1252"
+
+def check_encoding(data):
+	return decode_text(data)[1]
+
+def add_profile_hook(hook):
+	PROFILE_HOOKS.append(hook)
+
+def remove_profile_hook(hook):
+	PROFILE_HOOKS.remove(hook)
+
+@contextlib.contextmanager
+def profile_stage(stage):
+	# time the body for the profiling hooks, which get the stats dict it yields
+	# costs nothing but the dict when there are no hooks
+	stats = {}
+	if len(PROFILE_HOOKS) == 0:
+		yield stats
+		return
+	wall = time.perf_counter()
+	cpu = time.process_time()
 	try:
-		with open(infile, "r", encoding="utf-8") as f:
-			f.read()
-		return "utf-8"
+		yield stats
 	except:
-		return "cp1252"
-
-def output_sm(notes, last_note, measure_length, sm_diff, diff_value):
-	sm_notes = ''
-	if len(notes) > 0:
-		# write chart & difficulty info
-		sm_notes += "\n"
-		sm_notes += "//---------------bass-six - ----------------\n"
-		sm_notes += "#NOTEDATA:;\n"
-		sm_notes += "#STEPSTYPE:bass-six;\n"
-		sm_notes += "#DIFFICULTY:{};\n".format(sm_diff)
-		sm_notes += "#METER:{};\n".format(diff_value)
-		sm_notes += "#NOTES:\n"
-
-		# add notes for each measure
-		for measure_start in range(0, last_note + measure_length, measure_length):
-			measure_end = measure_start + measure_length
-			valid_indexes = set()
-			for i in range(measure_start, measure_end):
-				if i in notes:
-					valid_indexes.add(i - measure_start)
-			
+		stats["failed"] = True
+		raise
+	finally:
+		stats["wall"] = time.perf_counter() - wall
+		stats["cpu"] = time.process_time() - cpu
+		for hook in PROFILE_HOOKS:
+			hook(stage, stats)
+
+def profile_chunks(stage, chunks):
+	# time a lazily rendered note block for the profiling hooks, as it's consumed
+	if len(PROFILE_HOOKS) == 0:
+		return chunks
+	def timed_chunks():
+		stats = {"wall": 0, "cpu": 0, "chars": 0}
+		chunk_iter = iter(chunks)
+		while True:
+			wall = time.perf_counter()
+			cpu = time.process_time()
+			chunk = next(chunk_iter, None)
+			stats["wall"] += time.perf_counter() - wall
+			stats["cpu"] += time.process_time() - cpu
+			if chunk == None:
+				break
+			stats["chars"] += len(chunk)
+			yield chunk
+		for hook in PROFILE_HOOKS:
+			hook(stage, stats)
+	return timed_chunks()
+
+def profile_to_file(profile_path):
+	# add a profiling hook appending a JSON line per converted chart to profile_path
+	# lines are appended one at a time, so batch workers can share the file
+	stages = {}
+	def write_profile(stage, stats):
+		if stage == "chart":
+			with open(profile_path, "a", encoding="utf-8") as profile_file:
+				profile_file.write(json.dumps(dict(stats, stages=dict(stages))) + "\n")
+			stages.clear()
+		else:
+			stages[stage] = stats
+	add_profile_hook(write_profile)
+	return write_profile
+
+def output_sm_header(sm_diff, diff_value, stepstype=DEFAULT_STEPSTYPE, chart_name=None):
+	# chart & difficulty info
+	# chart_name tells apart the instruments of a simfile, when several are converted
+	return ("\n"
+		"//---------------{0} - {1}----------------\n"
+		"#NOTEDATA:;\n"
+		"{2}"
+		"#STEPSTYPE:{0};\n"
+		"#DIFFICULTY:{3};\n"
+		"#METER:{4};\n"
+		"#NOTES:\n").format(stepstype, chart_name or "", "#CHARTNAME:{};\n".format(chart_name) if chart_name != None else "", sm_diff, diff_value)
+
+def output_sm(notes, last_note, measure_length, sm_diff, diff_value, stepstype=DEFAULT_STEPSTYPE, chart_name=None):
+	# generate the NOTEDATA block one measure at a time, so it can be streamed to the simfile
+	if len(notes) == 0:
+		return
+
+	# write chart & difficulty info
+	yield output_sm_header(sm_diff, diff_value, stepstype, chart_name)
+
+	# bucket the note indexes by measure, so only measures with notes need any work
+	measures = {}
+	for index in sorted(notes):
+		measures.setdefault(index // measure_length, []).append(index)
+
+	# add notes for each measure
+	for measure_start in range(0, last_note + measure_length, measure_length):
+		if measure_start + measure_length > last_note:
+			measure_sep = ";\n"
+		else:
+			measure_sep = ",\n"
+
+		measure_indexes = measures.get(measure_start // measure_length)
+		if measure_indexes == None:
+			# gcd of an empty measure is the measure length, i.e. a single empty row
+			yield EMPTY_ROW + measure_sep
+		else:
 			# use gcd to minimize number of rows in each measure
-			note_step = measure_gcd(valid_indexes, measure_length)
-			for i in range(measure_start, measure_end, note_step):
-				if i not in notes:
-					sm_notes += '0'*NUM_COLUMNS + '\n'
-				else:
-					for digit in notes[i]:
-						sm_notes += str(digit)
-					sm_notes += '\n'
+			note_step = measure_gcd((i - measure_start for i in measure_indexes), measure_length)
+			rows = [EMPTY_ROW] * (measure_length // note_step)
+			for i in measure_indexes:
+				rows[(i - measure_start) // note_step] = ROW_STRINGS[notes[i]]
+			rows.append(measure_sep)
+			yield ''.join(rows)
+
+def notes_to_arrays(notes):
+	# convert a notes map to numpy arrays of sorted ticks & their packed rows
+	ticks = numpy.fromiter(notes.keys(), dtype=numpy.int64, count=len(notes))
+	rows = numpy.fromiter(notes.values(), dtype=numpy.int64, count=len(notes))
+	order = numpy.argsort(ticks)
+	return ticks[order], rows[order]
+
+def output_sm_numpy(ticks, rows, last_note, measure_length, sm_diff, diff_value, stepstype=DEFAULT_STEPSTYPE, chart_name=None):
+	# numpy version of output_sm, taking sorted ticks & their packed rows as arrays
+	# rows are rendered in bulk, NUMPY_MEASURE_CHUNK measures at a time, so memory doesn't grow with the chart's length
+	if len(ticks) == 0:
+		return
+
+	yield output_sm_header(sm_diff, diff_value, stepstype, chart_name)
+
+	# measures past the end of the chart aren't written
+	num_measures = len(range(0, last_note + measure_length, measure_length))
+	note_measures = ticks // measure_length
+	in_chart = note_measures < num_measures
+	ticks, rows, note_measures = ticks[in_chart], rows[in_chart], note_measures[in_chart]
+	offsets = ticks % measure_length
+	# like output_sm, measures from here on end with ';' instead of ','
+	last_measures = last_note // measure_length
+
+	def empty_measures(first, last):
+		# a run of measures without notes, a single empty row each
+		for start in range(first, last, NUMPY_MEASURE_CHUNK):
+			end = min(start + NUMPY_MEASURE_CHUNK, last)
+			commas = min(max(last_measures - start, 0), end - start)
+			yield EMPTY_ROW_MEASURE * commas + EMPTY_ROW_LAST_MEASURE * (end - start - commas)
+
+	# only chunks of measures with notes need arrays
+	chunks, chunk_starts = numpy.unique(note_measures // NUMPY_MEASURE_CHUNK, return_index=True)
+	chunk_ends = numpy.append(chunk_starts[1:], len(ticks))
+	row_size = len(EMPTY_ROW)
+	next_measure = 0
+	for chunk, start, end in zip(chunks.tolist(), chunk_starts.tolist(), chunk_ends.tolist()):
+		first = chunk * NUMPY_MEASURE_CHUNK
+		last = min(first + NUMPY_MEASURE_CHUNK, num_measures)
+		yield from empty_measures(next_measure, first)
+		next_measure = last
+		chunk_measures = note_measures[start:end] - first
+		chunk_offsets = offsets[start:end]
+
+		# use gcd to minimize number of rows in each measure, empty measures are a single row
+		note_steps = numpy.full(last - first, measure_length, dtype=numpy.int64)
+		measures, measure_starts = numpy.unique(chunk_measures, return_index=True)
+		note_steps[measures] = numpy.gcd(numpy.gcd.reduceat(chunk_offsets, measure_starts), measure_length)
+
+		# place every row of the chunk
+		measure_rows = measure_length // note_steps
+		row_ends = numpy.cumsum(measure_rows)
+		row_starts = row_ends - measure_rows
+		codes = numpy.zeros(int(row_ends[-1]), dtype=numpy.int16)
+		codes[row_starts[chunk_measures] + chunk_offsets // note_steps[chunk_measures]] = rows[start:end]
+
+		text = memoryview(ROW_BYTES[codes].view(numpy.uint8))
+		pieces = []
+		for measure, (row_start, row_end) in enumerate(zip((row_starts * row_size).tolist(), (row_ends * row_size).tolist()), first):
+			pieces.append(text[row_start:row_end])
+			pieces.append(b",\n" if measure < last_measures else b";\n")
+		yield b''.join(pieces).decode("ascii")
+	yield from empty_measures(next_measure, num_measures)
 
-			if measure_start + measure_length > last_note:
-				sm_notes += ";\n"
+def read_text(data):
+	# decode raw bytes with their detected encoding, as a file of lines with universal newlines
+	return io.StringIO(decode_text(data)[0], newline=None)
+
+def find_song_file(in_folder, file_names=None):
+	# look for the song audio file in a chart folder, None if there isn't one
+	# file_names optionally lists the FOLDER_FILES in the folder, saving a stat per audio file
+	song_file = None
+	for file in SONG_FILES:
+		if file_names != None:
+			found = file in file_names
+		else:
+			found = os.path.isfile(os.path.join(in_folder, file))
+		if found:
+			if song_file == None:
+				song_file = file
 			else:
-				sm_notes += ',\n'
-	return sm_notes
+				print("Warning: found {} & {}. Stems currently not supported in SM".format(song_file, file))
+	return song_file
 
-def process_song_ini(bpms):
-	# load the song.ini
-	songini_encoding = check_encoding(SONG_INI)
+def process_song_ini(bpms, song_ini, song_file):
+	# parse the song.ini contents, if there are any
 	songdata = {}
-	try:
-		with open(SONG_INI, "r", encoding=songini_encoding) as songini_file:
-			for line in songini_file:
+	if song_ini != None:
+		try:
+			for line in read_text(song_ini):
 				split_line = line.split("=", 1)
 				if len(split_line) == 2:
 					songdata_key = split_line[0].strip().lower()
 					songdata_value = split_line[1].strip()
 					if songdata_key not in songdata:
 						songdata[songdata_key] = songdata_value
-	except:
-		traceback.print_exc()
-		print("Failed to parse song.ini")
-		songdata = {}
-	
-	# look for the song audio file
-	song_file = None
-	for file in SONG_FILES:
-		if os.path.isfile(file):
-			if song_file == None:
-				song_file = file
-			else:
-				print("Warning: found {} & {}. Stems currently not supported in SM".format(song_file, file))
+		except:
+			traceback.print_exc()
+			print("Failed to parse song.ini")
+			songdata = {}
+
 	if song_file == None:
 		print("Warning: Audio file not found for chart")
 		song_file = "song.ogg"
@@ -179,302 +470,1685 @@ def process_song_ini(bpms):
 			pass
 	sm_header += bpms
 
-	# get guitar difficulty
-	if "diff_guitar" in songdata:
-		try:
-			diff_guitar = int(songdata["diff_guitar"])
-			if diff_guitar < 1:
-				diff_guitar = 1
-		except:
-			diff_guitar = 1
-	else:
-		diff_guitar = 1
-		
-	return sm_header, diff_guitar
+	# get each instrument's difficulty
+	diff_values = {}
+	for instrument in INSTRUMENTS:
+		diff_value = 1
+		if instrument[3] in songdata:
+			try:
+				diff_value = max(int(songdata[instrument[3]]), 1)
+			except:
+				pass
+		diff_values[instrument[0]] = diff_value
 
-def chart_get_notes(infile, diff_map, diff_value, measure_length, infile_encoding):
-	# create a map to access notes by their index (<index> = N 0 0)
-	notes = {}
-	last_note = 0
-	ch_diff, sm_diff = diff_map # e.g. [ExpertSingle], Challenge:
-	with open(infile, "r", encoding=infile_encoding) as chartfile:
-		line = "\n"
-		while len(line) > 0 and line.find(ch_diff) < 0: # e.g. [ExpertSingle]
-			line = chartfile.readline()
-		while len(line) > 0 and line.find("}") < 0:
-			line = chartfile.readline()
+	return sm_header, diff_values
+
+# instruments to convert mapped to the STEPSTYPE to write them as, None converts 1 guitar part as DEFAULT_STEPSTYPE
+# this is only the default of the stepstypes argument of the conversion functions, as set by the command line
+instrument_stepstypes = None
+
+def set_instrument_stepstypes(stepstypes):
+	global instrument_stepstypes
+	instrument_stepstypes = stepstypes
+
+def parse_instruments(text):
+	# parse a list of instruments like "guitar,bass=bass-six" into a map of instrument to STEPSTYPE
+	# instruments without a STEPSTYPE are DEFAULT_STEPSTYPE, "all" is every instrument
+	stepstypes = {}
+	for item in text.split(","):
+		names, sep, stepstype = item.partition("=")
+		names = names.strip().lower()
+		for name in INSTRUMENT_NAMES if names == "all" else (names,):
+			if name not in INSTRUMENT_NAMES:
+				raise ValueError("unknown instrument {}".format(name))
+			stepstypes[name] = stepstype.strip() or DEFAULT_STEPSTYPE
+	return stepstypes
+
+def convert_instruments(source, available, stepstypes=None):
+	# the instruments of a chart to convert, as [(instrument, STEPSTYPE, chart name or None)] in INSTRUMENTS order
+	# source is CHART_EXT or MID_EXT, available lists the instruments the chart has
+	# & stepstypes maps instruments to STEPSTYPEs like instrument_stepstypes, which is used if it's None
+	if stepstypes == None:
+		stepstypes = instrument_stepstypes
+	if stepstypes == None:
+		# a .chart always converts its guitar, a .mid the first of SINGLE_PART_INSTRUMENTS it has
+		if source == CHART_EXT:
+			return [("guitar", DEFAULT_STEPSTYPE, None)]
+		for name in SINGLE_PART_INSTRUMENTS:
+			if name in available:
+				return [(name, DEFAULT_STEPSTYPE, None)]
+		return []
+	return [(name, stepstypes[name], name) for name in INSTRUMENT_NAMES if name in stepstypes and name in available]
+
+def parse_chart(chartfile, instruments=INSTRUMENT_NAMES):
+	# read the .chart lines once, collecting resolution, tempo events & the notes of every difficulty of instruments
+	# chart_data["instruments"] has every instrument with a section in the chart, even if it's not in instruments
+	chart_data = {"resolution": None, "bpms": [], "notes": {}, "instruments": set()}
+	section_instruments = {diffmap[0]: name for name, diffmappings in INSTRUMENT_DIFFMAPPINGS.items() for diffmap in diffmappings}
+	diff_sections = [diffmap[0] for name in instruments for diffmap in INSTRUMENT_DIFFMAPPINGS[name]]
+	section = None
+	for line in chartfile:
+		if section == None:
+			# look for the next section header we care about, e.g. [ExpertSingle]
+			# UTF-16 & UTF-32 charts keep their BOM at the start of the first line
+			stripped = line.strip().lstrip("\ufeff")
+			if stripped == "[Song]" and chart_data["resolution"] == None:
+				section = stripped
+			elif stripped == "[SyncTrack]" or (stripped in diff_sections and stripped not in chart_data["notes"]):
+				section = stripped
+				if section in diff_sections:
+					chart_data["notes"][section] = []
+			if stripped in section_instruments:
+				chart_data["instruments"].add(section_instruments[stripped])
+			continue
+
+		if section == "[Song]":
+			reline = CHART_RESOLUTION_RE.search(line)
+			if reline and chart_data["resolution"] == None:
+				chart_data["resolution"] = int(reline.group(1))
+		elif section == "[SyncTrack]":
+			# find BPM line
+			reline = CHART_BPM_RE.search(line)
+			if reline:
+				chart_data["bpms"].append((int(reline.group(1)), int(reline.group(2))))
+		else:
 			# find note line
-			reline = re.search("(\d+) = N (\d) (\d+)", line)
+			reline = CHART_NOTE_RE.search(line)
 			if reline:
-				index = int(reline.group(1))
-				note = int(reline.group(2))
-				length = int(reline.group(3))
+				chart_data["notes"][section].append((int(reline.group(1)), int(reline.group(2)), int(reline.group(3))))
 
-				# ignore forced notes and other special notes
-				if note not in VALID_NOTES:
-					continue
-				
-				# convert CH open (7) to sm open (5)
-				if note == 7:
-					note = 5
-
-				# Initialize the notes array, each index representing an SM column
-				if index not in notes:
-					notes[index] = [0]*NUM_COLUMNS
-
-				# .chart 01234 are from green to orange
-				# 1 is "rice" (non-sustained note), 2 is "long note toggle on" (sustain on)
-				if length == 0:
-					notes[index][note] = 1
-				else:
-					notes[index][note] = 2
-					# 3 is "long note toggle off", so we need to set it after a 2
-					sustain_end = index + length
-					if sustain_end not in notes:
-						notes[sustain_end] = [0]*NUM_COLUMNS
-					notes[sustain_end][note] = 3
-					if last_note <= sustain_end:
-						last_note = sustain_end + 1
-
-				if last_note <= index:
-					last_note = index + 1
-					
-	# output the chart text	
-	return output_sm(notes, last_note, measure_length, sm_diff, diff_value)
-
-def chart_to_sm(infile):
-	# look for [Song] and chart resolution
-	chart_resolution = 0
-	measure_length = 0
-	infile_encoding = check_encoding(infile)
-	with open(infile, "r", encoding=infile_encoding) as chartfile:
-		line = "\n"
-		while len(line) > 0 and line.find("[Song]") < 0:
-			line = chartfile.readline()
-		reline = None
-		while len(line) > 0 and not reline:
-			line = chartfile.readline()
-			reline = re.search("Resolution = (\d+)", line)
+		if line.find("}") >= 0:
+			section = None
+
+	if chart_data["resolution"] == None:
+		chart_data["resolution"] = 192
+	return chart_data
+
+def chart_section_index(chart):
+	# find every section of .chart bytes without decoding them, as {"[ExpertSingle]": (byte offset, byte length), ...}
+	# a section runs from its [Section] line through its closing } line, the first of repeated sections is kept
+	# returns None for UTF-16 & UTF-32 charts, whose bytes can't be scanned for ASCII
+	if check_bom(chart) not in (None, "utf_8_sig"):
+		return None
+	index = {}
+	pos = 0
+	while True:
+		header = CHART_SECTION_RE.search(chart, pos)
+		if header == None:
+			break
+		# like parse_chart, a section ends at the first line with a }
+		pos = chart.find(b"}", header.end())
+		if pos >= 0:
+			pos = chart.find(b"\n", pos)
+		pos = len(chart) if pos < 0 else pos + 1
+		index.setdefault(header.group(1).decode("ascii", "replace"), (header.start(1), pos - header.start(1)))
+	return index
+
+def chart_index(chart_path, sidecar=None):
+	# the chart_section_index of a .chart file, None if it can't be indexed
+	# sidecar is a file to reuse it from while the chart's size & modification time are unchanged, & to save it to otherwise
+	chart_stat = os.stat(chart_path)
+	if sidecar != None:
 		try:
-			chart_resolution = int(reline.group(1))
-		except:
-			chart_resolution = 192
-		measure_length = chart_resolution * 4
-	
-	# look for [SyncTrack] and BPMs
-	bpms = "#BPMS:"
-	with open(infile, "r", encoding=infile_encoding) as chartfile:
-		bpm = None
-		line = "\n"
-		while len(line) > 0 and line.find("[SyncTrack]") < 0:
-			line = chartfile.readline()
-		while len(line) > 0 and line.find("}") < 0:
-			line = chartfile.readline()
-			# find BPM line
-			reline = re.search("(\d+) = B (\d+)", line)
-			if reline:
-				index = float(reline.group(1)) / chart_resolution
-				bpm = float(reline.group(2)) / 1000
-				bpms += "{}={},".format(index, bpm)
-		# handle case where no bpms were found
-		if bpm == None:
-			index = 0
-			bpm = 120
-			bpms += "{}={},".format(index, bpm)
-	# add semicolon to end of BPM header entry
-	bpms = bpms[:-1] + ";\n"
+			with open(sidecar, "r", encoding="utf-8") as index_file:
+				saved = json.load(index_file)
+			if saved["format"] == CHART_INDEX_FORMAT and saved["size"] == chart_stat.st_size and saved["mtime_ns"] == chart_stat.st_mtime_ns:
+				return {section: tuple(span) for section, span in saved["sections"].items()}
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError, KeyError, TypeError):
+			traceback.print_exc()
+			print("Warning: ignoring unreadable {}".format(sidecar))
 
-	# get sm_header metadata & difficulty value out of the song.ini
-	sm_header, diff_guitar = process_song_ini(bpms)
-	# make sure we didn't return an error
-	if type(sm_header) == int:
-		return sm_header
-
-	# write simfile
-	with open("notes.ssc", "w", encoding="utf-8") as outfile:
-		outfile.write(sm_header)					
-		for diffmap in DIFFMAPPINGS:
-			sm_notes = chart_get_notes(infile, diffmap, diff_guitar, measure_length, infile_encoding)
-			if len(sm_notes) > 0:
-				outfile.write(sm_notes)
-				
-	return 0
+	with profile_stage("index") as stats:
+		with open(chart_path, "rb") as chartfile:
+			chart = chartfile.read()
+		index = chart_section_index(chart)
+		stats["bytes"] = len(chart)
+	if index != None and sidecar != None:
+		try:
+			with open(sidecar + ".tmp", "w", encoding="utf-8") as index_file:
+				json.dump({"format": CHART_INDEX_FORMAT, "size": chart_stat.st_size, "mtime_ns": chart_stat.st_mtime_ns, "sections": index}, index_file)
+			os.replace(sidecar + ".tmp", sidecar)
+		except OSError:
+			traceback.print_exc()
+			print("Warning: failed to write {}".format(sidecar))
+	return index
 
-def mid_get_notes(track_notes, diffmap, diff_value, measure_length):
-	sm_diff = diffmap[0]
-	green_note = diffmap[1]
-	diff_notes = (green_note, green_note+1, green_note+2, green_note+3, green_note+4)
-	open_sysex = diffmap[2]
-	
+def read_chart_sections(chart_path, sections, sidecar=None):
+	# read only some sections of a .chart file, e.g. ("[SyncTrack]", "[ExpertSingle]"), seeking to each with chart_index
+	# returns {section: raw bytes} for the sections the chart has, which parse_chart(read_text(...)) reads like a chart,
+	# or None if the chart can't be indexed
+	index = chart_index(chart_path, sidecar)
+	if index == None:
+		return None
+	section_data = {}
+	with open(chart_path, "rb") as chartfile:
+		for section in sections:
+			if section in index:
+				offset, length = index[section]
+				chartfile.seek(offset)
+				section_data[section] = chartfile.read(length)
+	return section_data
+
+def chart_get_notes(chart_notes, diff_map, diff_value, measure_length, stepstype=DEFAULT_STEPSTYPE, chart_name=None):
+	# create a map to access packed rows of notes by their index (<index> = N 0 0)
 	notes = {}
-	active_notes = {}
+	last_note = 0
+	ch_diff, sm_diff = diff_map # e.g. [ExpertSingle], Challenge:
+	for index, note, length in chart_notes.get(ch_diff, ()):
+		# ignore forced notes and other special notes
+		if note not in VALID_NOTES:
+			continue
+
+		# convert CH open (7) to sm open (5)
+		if note == 7:
+			note = 5
+
+		# .chart 01234 are from green to orange
+		# 1 is "rice" (non-sustained note), 2 is "long note toggle on" (sustain on)
+		if length == 0:
+			notes[index] = set_lane(notes.get(index, 0), note, 1)
+		else:
+			notes[index] = set_lane(notes.get(index, 0), note, 2)
+			# 3 is "long note toggle off", so we need to set it after a 2
+			sustain_end = index + length
+			notes[sustain_end] = set_lane(notes.get(sustain_end, 0), note, 3)
+			if last_note <= sustain_end:
+				last_note = sustain_end + 1
+
+		if last_note <= index:
+			last_note = index + 1
+
+	# output the chart text
+	return output_sm(notes, last_note, measure_length, sm_diff, diff_value, stepstype, chart_name)
+
+def chart_get_notes_numpy(chart_notes, diff_map, diff_value, measure_length, stepstype=DEFAULT_STEPSTYPE, chart_name=None):
+	# numpy version of chart_get_notes
+	ch_diff, sm_diff = diff_map # e.g. [ExpertSingle], Challenge:
+	events = numpy.array(chart_notes.get(ch_diff, ()), dtype=numpy.int64).reshape(-1, 3)
+	index, note, length = events[:, 0], events[:, 1], events[:, 2]
+
+	# ignore forced notes and other special notes, convert CH open (7) to sm open (5)
+	valid = numpy.isin(note, VALID_NOTES)
+	index, note, length = index[valid], note[valid], length[valid]
+	if len(index) == 0:
+		return iter(())
+	note = numpy.where(note == 7, 5, note)
+	sustain = length != 0
+
+	# lane writes in the same order as chart_get_notes: each note (1 or 2), then its sustain end (3)
+	write_ticks = numpy.stack((index, index + length), axis=1).ravel()
+	write_lanes = numpy.repeat(note, 2)
+	write_values = numpy.stack((numpy.where(sustain, 2, 1), numpy.full_like(note, 3)), axis=1).ravel()
+	written = numpy.stack((numpy.ones_like(sustain), sustain), axis=1).ravel()
+	write_ticks, write_lanes, write_values = write_ticks[written], write_lanes[written], write_values[written]
+
+	# the last write to each lane of a tick wins
+	write_keys = write_ticks * NUM_COLUMNS + write_lanes
+	order = numpy.argsort(write_keys, kind="stable")
+	sorted_keys = write_keys[order]
+	final = order[numpy.append(sorted_keys[1:] != sorted_keys[:-1], True)]
+
+	# pack the lanes of each tick into rows
+	ticks, tick_rows = numpy.unique(write_ticks[final], return_inverse=True)
+	rows = numpy.zeros(len(ticks), dtype=numpy.int64)
+	numpy.bitwise_or.at(rows, tick_rows, write_values[final] << (write_lanes[final] * LANE_BITS))
+
+	last_note = int(write_ticks.max()) + 1
+	return output_sm_numpy(ticks, rows, last_note, measure_length, sm_diff, diff_value, stepstype, chart_name)
+
+def chart_to_ir(chart, stepstypes=None):
+	# parse .chart bytes into the intermediate representation, see ir_to_sm
+	with profile_stage("encoding") as stats:
+		chartfile = read_text(chart)
+		stats["bytes"] = len(chart)
+
+	# parse the whole chart in a single pass, including every instrument that could be converted
+	instruments = [instrument[0] for instrument in convert_instruments(CHART_EXT, INSTRUMENT_NAMES, stepstypes)]
+	with profile_stage("parse") as stats:
+		chart_data = parse_chart(chartfile, instruments)
+
+	return {"source": CHART_EXT,
+			"resolution": chart_data["resolution"],
+			"tempos": [(tick, float(milli_bpm) / 1000) for tick, milli_bpm in chart_data["bpms"]],
+			"available": [name for name in INSTRUMENT_NAMES if name in chart_data["instruments"]],
+			"instruments": {name: (0, [chart_data["notes"].get(diffmap[0], []) for diffmap in INSTRUMENT_DIFFMAPPINGS[name]])
+				for name in instruments if name in chart_data["instruments"]}}
+
+def chart_to_sm(chart, song_ini, song_file, stepstypes=None):
+	return ir_to_sm(chart_to_ir(chart, stepstypes), song_ini, song_file, stepstypes)
+
+def mid_note_events(track_notes):
+	# demultiplex the note events of every difficulty in a single pass over the track
+	# returns a list of (tick, MID_NOTE_ON/MID_NOTE_OFF/MID_OPEN, lane) per MIDDIFFMAPPINGS entry & the last tick of the track
+	all_events = [[] for diffmap in MIDDIFFMAPPINGS]
 	current_tick = 0
 	for msg in track_notes:
 		current_tick += msg.time
-		if msg.type == "note_on" and msg.note in diff_notes:
-			if msg.velocity > 0:
-				# note on event
-				index = current_tick
-				note = msg.note - green_note
-				active_notes[note] = index
-
-				# Initialize the notes array, each index representing an SM column
-				if index not in notes:
-					notes[index] = [0]*NUM_COLUMNS
-
-				# .chart 01234 are from green to orange
-				# 1 is "rice" (non-sustained note), 2 is "long note toggle on" (sustain on)
-				notes[index][note] = 1
-			elif msg.velocity == 0:
-				index = current_tick
-				note = msg.note - green_note
-				
-				if note not in active_notes:
-					print("Warning: note_off not corresponding to a note_on event")
-					continue
-				
-				old_index = active_notes[note]
-				if index - old_index >= int(round(measure_length / SUSTAIN_THRESH)):
-					# sustain, so convert note to long note
-					notes[old_index][note] = 2
-					if index not in notes:
-						notes[index] = [0]*NUM_COLUMNS
-					notes[index][note] = 3
-				
-				# check if this note is actually an open note
-				if 5 in active_notes and active_notes[5] == active_notes[note]:
-					note_value = notes[old_index][note]
-					notes[old_index][5] = note_value
-					notes[old_index][note] = 0
-					if note_value == 2:
-						notes[index][5] = 3
-						notes[index][note] = 0
-
-				del active_notes[note]
-		elif msg.type == "sysex":
+		msg_type = msg.type
+		if msg_type == "note_on":
+			note_lane = MID_NOTE_LANES.get(msg.note)
+			if note_lane == None:
+				continue
+			diff_index, note = note_lane
+			all_events[diff_index].append((current_tick, MID_NOTE_ON if msg.velocity > 0 else MID_NOTE_OFF, note))
+		elif msg_type == "sysex":
 			# remember that there should be an open note at this index
-			if msg.data == open_sysex:
-				index = current_tick
-				note = 5
-				active_notes[note] = index
+			diff_index = MID_OPEN_SYSEX.get(msg.data)
+			if diff_index != None:
+				all_events[diff_index].append((current_tick, MID_OPEN, 5))
+	return all_events, current_tick
 
-	last_note = current_tick
-	
-	# output the chart text
-	return output_sm(notes, last_note, measure_length, sm_diff, diff_value)
+def mid_events_to_notes(events, measure_length):
+	# pair up one difficulty's note events from mid_note_events into a notes map
+	notes = {}
+	active_notes = {}
+	sustain_length = int(round(measure_length / SUSTAIN_THRESH))
+	for index, kind, note in events:
+		if kind == MID_NOTE_ON:
+			# note on event
+			active_notes[note] = index
+
+			# .chart 01234 are from green to orange
+			# 1 is "rice" (non-sustained note), 2 is "long note toggle on" (sustain on)
+			notes[index] = set_lane(notes.get(index, 0), note, 1)
+		elif kind == MID_NOTE_OFF:
+			if note not in active_notes:
+				print("Warning: note_off not corresponding to a note_on event")
+				continue
 
-def mid_to_sm(infile):
+			old_index = active_notes[note]
+			if index - old_index >= sustain_length:
+				# sustain, so convert note to long note
+				notes[old_index] = set_lane(notes[old_index], note, 2)
+				notes[index] = set_lane(notes.get(index, 0), note, 3)
+
+			# check if this note is actually an open note
+			if 5 in active_notes and active_notes[5] == active_notes[note]:
+				note_value = get_lane(notes[old_index], note)
+				notes[old_index] = set_lane(set_lane(notes[old_index], 5, note_value), note, 0)
+				if note_value == 2:
+					notes[index] = set_lane(set_lane(notes[index], 5, 3), note, 0)
+
+			del active_notes[note]
+		else:
+			active_notes[5] = index
+	return notes
+
+def mid_get_notes(track_notes, measure_length):
+	# returns a notes map per MIDDIFFMAPPINGS entry & the last tick of the track
+	all_events, last_tick = mid_note_events(track_notes)
+	return [mid_events_to_notes(events, measure_length) for events in all_events], last_tick
+
+def mid_to_ir(chart, stepstypes=None):
+	# parse .mid bytes into the intermediate representation, see ir_to_sm
 	try:
-		mid = mido.MidiFile(infile)
+		# only decode the tempomap for now, the notes track is decoded once it's picked below
+		with profile_stage("midi_load") as stats:
+			mid = mido.MidiFile(file=io.BytesIO(chart), load_tracks=lambda i, name: i == 0)
+			stats["bytes"] = len(chart)
 	except:
 		traceback.print_exc()
-		print("Failed to load {}".format(infile))
-		return 1
+		print("Failed to load MIDI")
+		return None
 	track_tempomap = None
-	track_guitar = None
-	track_t1gems = None
-	track_rhythm = None
-	track_bass = None
-	track_notes = None
-	
-	chart_resolution = mid.ticks_per_beat
-	measure_length = chart_resolution * 4
+	named_tracks = {}
 	
 	for i, track in enumerate(mid.tracks):
 		# midi spec says tempomap must be first track
 		if i == 0:
 			track_tempomap = track
 		else:
-			if track.name == "PART GUITAR":
-				track_guitar = track
-			elif track.name == "T1 GEMS":
-				track_t1gems = track
-			elif track.name == "PART RHYTHM":
-				track_rhythm = track
-			elif track.name == "PART BASS":
-				track_bass = track
-			
-	# stepmania outfox 4.9.6 currently only supports 1 open-note instrument: bass-six
-	# so pick 1 guitar track in the midi to use
-	if track_guitar != None:
-		track_notes = track_guitar
-	elif track_t1gems != None:
-		track_notes = track_t1gems
-	elif track_rhythm != None:
-		track_notes = track_rhythm
-	elif track_bass != None:
-		track_notes = track_bass
-	else:
+			named_tracks[track.name] = track
+
+	# find each instrument's track
+	instrument_tracks = {}
+	for instrument in INSTRUMENTS:
+		for track_name in instrument[2]:
+			if track_name in named_tracks:
+				instrument_tracks[instrument[0]] = named_tracks[track_name]
+				break
+	if len(instrument_tracks) == 0:
 		print("Error: no valid notes track found in MIDI")
-		return 1
-		
+		return None
+
 	# parse tempomap
-	bpms = "#BPMS:"
+	tempos = []
 	current_tick = 0
-	bpm = None
 	for msg in track_tempomap:
 		current_tick += msg.time
 		if msg.type == "set_tempo":
-			index = current_tick / chart_resolution
-			bpm = mido.tempo2bpm(msg.tempo)
+			tempos.append((current_tick, mido.tempo2bpm(msg.tempo)))
+
+	# only the tracks of instruments being converted are decoded
+	available = [name for name in INSTRUMENT_NAMES if name in instrument_tracks]
+	instruments = {}
+	for name, stepstype, chart_name in convert_instruments(MID_EXT, available, stepstypes):
+		stage_suffix = "" if chart_name == None else ":" + name
+		try:
+			with profile_stage("midi_track" + stage_suffix) as stats:
+				track_notes = instrument_tracks[name].decode()
+				stats["messages"] = len(track_notes)
+		except:
+			traceback.print_exc()
+			print("Failed to load MIDI")
+			return None
+
+		# the notes of every difficulty come out of a single pass
+		with profile_stage("note_events" + stage_suffix) as stats:
+			all_events, end_tick = mid_note_events(track_notes)
+			stats["events"] = {diffmap[0]: len(events) for diffmap, events in zip(MIDDIFFMAPPINGS, all_events)}
+		instruments[name] = (end_tick, all_events)
+
+	return {"source": MID_EXT,
+			"resolution": mid.ticks_per_beat,
+			"tempos": tempos,
+			"available": available,
+			"instruments": instruments}
+
+def mid_to_sm(chart, song_ini, song_file, stepstypes=None):
+	ir = mid_to_ir(chart, stepstypes)
+	if ir == None:
+		return None
+	return ir_to_sm(ir, song_ini, song_file, stepstypes)
+
+def ir_to_sm(ir, song_ini, song_file, stepstypes=None):
+	# render a chart's intermediate representation, as made by chart_to_ir or mid_to_ir, to simfile chunks
+	# the representation holds the source (CHART_EXT or MID_EXT), resolution, [(tick, bpm)] tempos, the available instruments
+	# of the chart & the parsed ones, each with the last tick of a .mid's notes track & the notes of every difficulty,
+	# in CHART_DIFFS or MIDDIFFMAPPINGS order:
+	# [(tick, note, length)] from a .chart, or [(tick, MID_NOTE_ON/MID_NOTE_OFF/MID_OPEN, lane)] events from a .mid
+	# settings like SUSTAIN_THRESH only apply here, so the representation can be reused when they change
+	instruments = convert_instruments(ir["source"], ir["available"], stepstypes)
+	if ir["source"] == MID_EXT and len(instruments) == 0:
+		print("Error: no valid notes track found in MIDI")
+		return None
+	chart_resolution = ir["resolution"]
+	measure_length = chart_resolution * 4
+
+	# convert BPMs
+	with profile_stage("tempo_map") as stats:
+		bpms = "#BPMS:"
+		bpm = None
+		for tick, bpm in ir["tempos"]:
+			index = tick / chart_resolution
 			bpms += "{}={},".format(index, bpm)
-	# handle case where no bpms were found
-	if bpm == None:
-		index = 0
-		bpm = 120
-		bpms += "{}={},".format(index, bpm)
-	# add semicolon to end of BPM header entry
-	bpms = bpms[:-1] + ";\n"
-	
+		# handle case where no bpms were found
+		if bpm == None:
+			index = 0
+			bpm = 120
+			bpms += "{}={},".format(index, bpm)
+		# add semicolon to end of BPM header entry
+		bpms = bpms[:-1] + ";\n"
+		stats["tempos"] = len(ir["tempos"])
+
 	# get sm_header metadata & difficulty value out of the song.ini
-	sm_header, diff_guitar = process_song_ini(bpms)
+	with profile_stage("song_ini"):
+		sm_header, diff_values = process_song_ini(bpms, song_ini, song_file)
 	# make sure we didn't return an error
 	if type(sm_header) == int:
-		return sm_header
-
-	with open("notes.ssc", "w", encoding="utf-8") as outfile:
-		outfile.write(sm_header)					
-		for diffmap in MIDDIFFMAPPINGS:
-			sm_notes = mid_get_notes(track_notes, diffmap, diff_guitar, measure_length)
-			if len(sm_notes) > 0:
-				outfile.write(sm_notes)
-				
+		return None
+
+	# each difficulty's notes are streamed into the simfile as they're written
+	note_blocks = []
+	for name, stepstype, chart_name in instruments:
+		last_note, all_notes = ir["instruments"].get(name, (0, [[] for diffmap in CHART_DIFFS]))
+		# a single converted part keeps the guitar difficulty, whichever instrument it is
+		diff_value = diff_values["guitar" if chart_name == None else name]
+		stage_prefix = "" if chart_name == None else name + ":"
+		if ir["source"] == CHART_EXT:
+			diffmappings = INSTRUMENT_DIFFMAPPINGS[name]
+			chart_notes = {diffmap[0]: notes for diffmap, notes in zip(diffmappings, all_notes)}
+			get_notes = chart_get_notes_numpy if numpy_engine else chart_get_notes
+			for diffmap in diffmappings:
+				with profile_stage("notes:" + stage_prefix + diffmap[1]) as stats:
+					note_blocks.append(profile_chunks("render:" + stage_prefix + diffmap[1],
+						get_notes(chart_notes, diffmap, diff_value, measure_length, stepstype, chart_name)))
+					stats["notes"] = len(chart_notes[diffmap[0]])
+		else:
+			for diffmap, events in zip(MIDDIFFMAPPINGS, all_notes):
+				with profile_stage("notes:" + stage_prefix + diffmap[0]) as stats:
+					notes = mid_events_to_notes(events, measure_length)
+					stats["rows"] = len(notes)
+				if numpy_engine:
+					note_block = output_sm_numpy(*notes_to_arrays(notes), last_note, measure_length, diffmap[0], diff_value, stepstype, chart_name)
+				else:
+					note_block = output_sm(notes, last_note, measure_length, diffmap[0], diff_value, stepstype, chart_name)
+				note_blocks.append(profile_chunks("render:" + stage_prefix + diffmap[0], note_block))
+	return itertools.chain([sm_header], *note_blocks)
+
+def save_ir(path, ir, source_key):
+	# write a chart's intermediate representation to a binary sidecar file,
+	# tagged with source_key so it's only used for the same source bytes
+	header = {"format": IR_FORMAT, "key": source_key, "source": ir["source"], "resolution": ir["resolution"],
+		"byteorder": sys.byteorder, "tempos": len(ir["tempos"]), "available": ir["available"],
+		"instruments": [[name, end_tick, [len(notes) for notes in all_notes]] for name, (end_tick, all_notes) in ir["instruments"].items()]}
+	header_bytes = json.dumps(header).encode("utf-8")
+	with open(path + ".tmp", "wb") as ir_file:
+		ir_file.write(IR_MAGIC + IR_HEADER.pack(len(header_bytes)) + header_bytes)
+		ir_file.write(array.array("q", (tick for tick, bpm in ir["tempos"])).tobytes())
+		ir_file.write(array.array("d", (bpm for tick, bpm in ir["tempos"])).tobytes())
+		for end_tick, all_notes in ir["instruments"].values():
+			for notes in all_notes:
+				ir_file.write(array.array("q", itertools.chain.from_iterable(notes)).tobytes())
+	os.replace(path + ".tmp", path)
+
+def load_ir(path, source_key):
+	# read a sidecar written by save_ir, None if it's missing, unreadable or for other source bytes
+	try:
+		with open(path, "rb") as ir_file:
+			data = ir_file.read()
+		if data[:len(IR_MAGIC)] != IR_MAGIC:
+			return None
+		pos = len(IR_MAGIC)
+		header_size, = IR_HEADER.unpack_from(data, pos)
+		pos += IR_HEADER.size
+		header = json.loads(data[pos:pos + header_size].decode("utf-8"))
+		pos += header_size
+		if header["format"] != IR_FORMAT or header["key"] != source_key:
+			return None
+
+		def read_array(typecode, length):
+			nonlocal pos
+			values = array.array(typecode)
+			values.frombytes(data[pos:pos + length * values.itemsize])
+			if len(values) != length:
+				raise ValueError("truncated sidecar")
+			if header["byteorder"] != sys.byteorder:
+				values.byteswap()
+			pos += length * values.itemsize
+			return values
+
+		ticks = read_array("q", header["tempos"])
+		bpms = read_array("d", header["tempos"])
+		instruments = {}
+		for name, end_tick, note_counts in header["instruments"]:
+			all_notes = []
+			for num_notes in note_counts:
+				values = read_array("q", num_notes * 3)
+				all_notes.append(list(zip(values[0::3], values[1::3], values[2::3])))
+			instruments[name] = (end_tick, all_notes)
+		return {"source": header["source"],
+				"resolution": header["resolution"],
+				"tempos": list(zip(ticks, bpms)),
+				"available": header["available"],
+				"instruments": instruments}
+	except FileNotFoundError:
+		return None
+	except (OSError, ValueError, KeyError, struct.error):
+		traceback.print_exc()
+		print("Warning: ignoring unreadable {}".format(path))
+		return None
+
+# whether simfile_chunks keeps each chart's intermediate representation in a sidecar next to it
+ir_sidecars = False
+
+def set_ir_sidecars(enabled):
+	global ir_sidecars
+	ir_sidecars = enabled
+
+def chart_ir(chart, chart_ext, sidecar=None, stepstypes=None):
+	# the intermediate representation of chart bytes with the instruments of stepstypes, None if unsupported or the chart failed to load
+	# sidecar is a file to reuse it from if it's for the same bytes & has the instruments being converted, & to save it to otherwise
+	source_key = None
+	if sidecar != None:
+		with profile_stage("ir_load") as stats:
+			source_key = hashlib.sha1(chart).hexdigest()
+			ir = load_ir(sidecar, source_key)
+			if ir != None and any(name in ir["available"] and name not in ir["instruments"]
+					for name, stepstype, chart_name in convert_instruments(ir["source"], ir["available"], stepstypes)):
+				ir = None
+			stats["hit"] = ir != None
+		if ir != None:
+			return ir
+
+	if chart_ext.lower() == MID_EXT:
+		ir = mid_to_ir(chart, stepstypes)
+	elif chart_ext.lower() == CHART_EXT:
+		ir = chart_to_ir(chart, stepstypes)
+	else:
+		return None
+
+	if ir != None and sidecar != None:
+		with profile_stage("ir_save"):
+			try:
+				save_ir(sidecar, ir, source_key)
+			except (OSError, OverflowError):
+				traceback.print_exc()
+				print("Warning: failed to write {}".format(sidecar))
+	return ir
+
+def read_chart(chart, chart_ext=None, sidecar=None):
+	# read a chart path for simfile_chunks, returns (chart bytes, chart_ext, sidecar)
+	# chart_ext is taken from the path if not given & sidecar is next to it by default if ir_sidecars is on
+	# chart bytes are returned as they are
+	if isinstance(chart, str):
+		if chart_ext == None:
+			chart_ext = os.path.splitext(chart)[1]
+		if sidecar == None and ir_sidecars:
+			sidecar = chart + IR_SIDECAR_EXT
+		with profile_stage("read") as stats:
+			with open(chart, "rb") as chartfile:
+				chart = chartfile.read()
+			stats["bytes_read"] = len(chart)
+	return chart, chart_ext, sidecar
+
+def simfile_chunks(chart, chart_ext=None, song_ini=None, song_file=None, sidecar=None, stepstypes=None):
+	# convert a chart to an iterable of simfile text chunks, None if the conversion failed
+	# chart is a path or bytes, chart_ext is CHART_EXT or MID_EXT (taken from the path if not given)
+	# song_ini is the song.ini bytes & song_file the audio file name, if there are any
+	# sidecar is where to keep the chart's intermediate representation, next to the chart path by default if ir_sidecars is on
+	# stepstypes maps the instruments to convert to their STEPSTYPE, see parse_instruments, instrument_stepstypes if not given
+	chart, chart_ext, sidecar = read_chart(chart, chart_ext, sidecar)
+	if chart_ext == None:
+		return None
+	ir = chart_ir(chart, chart_ext, sidecar, stepstypes)
+	if ir == None:
+		return None
+	return ir_to_sm(ir, song_ini, song_file, stepstypes)
+
+def convert_chart(chart, chart_ext=None, song_ini=None, song_file=None, stepstypes=None):
+	# convert a .chart or .mid without touching the cwd, see simfile_chunks for the arguments
+	# returns the .ssc text, or None if the conversion failed
+	sm_chunks = simfile_chunks(chart, chart_ext, song_ini, song_file, stepstypes=stepstypes)
+	if sm_chunks == None:
+		return None
+	return ''.join(sm_chunks)
+
+def render_settings():
+	# the settings ir_to_sm renders with, besides the instruments to convert
+	# converted simfiles are only reused while they're the same, see ConversionCache.key
+	return [SUSTAIN_THRESH, DEFAULT_STEPSTYPE]
+
+class ConversionCache:
+	# content-addressed store of converted simfiles, so a duplicate chart is a lookup & a copy
+	# entries are keyed by the chart, song.ini & audio file name, the converter VERSION, instruments & render_settings,
+	# & the least recently used are evicted once the cache is over max_size bytes
+	def __init__(self, folder, max_size=CACHE_MAX_SIZE):
+		self.folder = os.path.abspath(folder)
+		self.max_size = max_size
+		self.stores = 0
+
+	def key(self, chart, chart_ext, song_ini, song_file, stepstypes=None):
+		key_data = [VERSION, chart_ext.lower(), song_file, len(chart), None if song_ini == None else len(song_ini), render_settings()]
+		if stepstypes == None:
+			stepstypes = instrument_stepstypes
+		if stepstypes != None:
+			key_data.append(stepstypes)
+		key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode("utf-8"))
+		key.update(chart)
+		if song_ini != None:
+			key.update(song_ini)
+		return key.hexdigest()
+
+	def entry_path(self, key):
+		return os.path.join(self.folder, key[:2], key + ".ssc")
+
+	def get(self, key):
+		# path of the cached .ssc, or None, marking it as recently used
+		path = self.entry_path(key)
+		try:
+			os.utime(path)
+		except OSError:
+			return None
+		return path
+
+	def put(self, key, sm_text):
+		path = self.entry_path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		# other processes may be storing the same chart, so write a private file & move it in place
+		temp_path = "{}.{}.tmp".format(path, os.getpid())
+		with open(temp_path, "w", encoding="utf-8", newline="") as entry_file:
+			entry_file.write(sm_text)
+		os.replace(temp_path, path)
+		self.stores += 1
+		if self.stores % CACHE_PRUNE_EVERY == 0:
+			self.prune()
+
+	def entries(self):
+		# [(last used, size, path)] of every cached .ssc, oldest first
+		entries = []
+		try:
+			with os.scandir(self.folder) as buckets:
+				for bucket in buckets:
+					if bucket.is_dir():
+						with os.scandir(bucket.path) as bucket_entries:
+							for entry in bucket_entries:
+								if entry.name.endswith(".ssc"):
+									stat = entry.stat()
+									entries.append((stat.st_mtime, stat.st_size, entry.path))
+		except FileNotFoundError:
+			pass
+		entries.sort()
+		return entries
+
+	def prune(self, max_size=None):
+		# evict the least recently used entries until the cache fits in max_size, returns (entries, bytes) removed
+		if max_size == None:
+			max_size = self.max_size
+		entries = self.entries()
+		total_size = sum(size for last_used, size, path in entries)
+		removed = 0
+		removed_size = 0
+		for last_used, size, path in entries:
+			if total_size - removed_size <= max_size:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				continue
+			removed += 1
+			removed_size += size
+		return removed, removed_size
+
+# the ConversionCache used by write_chart, if any
+conversion_cache = None
+
+def set_conversion_cache(cache):
+	global conversion_cache
+	conversion_cache = cache
+
+def write_chart(outfile, chart, chart_ext=None, song_ini=None, song_file=None, sidecar=None, stepstypes=None):
+	# like convert_chart, but streams the .ssc to outfile, a path or a text file
+	# returns 0 on success, 1 if the conversion failed
+	cache_key = None
+	if conversion_cache != None:
+		# the cache key needs the bytes, which are then passed on to simfile_chunks
+		chart, chart_ext, sidecar = read_chart(chart, chart_ext, sidecar)
+		if chart_ext != None:
+			with profile_stage("cache") as stats:
+				cache_key = conversion_cache.key(chart, chart_ext, song_ini, song_file, stepstypes)
+				cached = conversion_cache.get(cache_key)
+				stats["hit"] = cached != None
+			if cached != None:
+				with profile_stage("write") as stats:
+					with open(cached, "r", encoding="utf-8", newline="") as cached_file:
+						if isinstance(outfile, str):
+							with open(outfile, "w", encoding="utf-8") as ssc_file:
+								for chunk in iter(lambda: cached_file.read(1 << 20), ""):
+									ssc_file.write(chunk)
+								stats["bytes_written"] = ssc_file.tell()
+						else:
+							for chunk in iter(lambda: cached_file.read(1 << 20), ""):
+								outfile.write(chunk)
+				return 0
+
+	sm_chunks = simfile_chunks(chart, chart_ext, song_ini, song_file, sidecar, stepstypes)
+	if sm_chunks == None:
+		return 1
+	if cache_key != None:
+		# keep the chunks as they're written, for the cache
+		written_chunks = []
+		sm_chunks = (written_chunks.append(chunk) or chunk for chunk in sm_chunks)
+	# notes are rendered as they're written, so this includes the render stages
+	with profile_stage("write") as stats:
+		if isinstance(outfile, str):
+			with open(outfile, "w", encoding="utf-8") as ssc_file:
+				ssc_file.writelines(sm_chunks)
+				stats["bytes_written"] = ssc_file.tell()
+		else:
+			outfile.writelines(sm_chunks)
+	if cache_key != None:
+		try:
+			conversion_cache.put(cache_key, ''.join(written_chunks))
+		except OSError:
+			traceback.print_exc()
+			print("Warning: failed to store the simfile in the cache")
 	return 0
 
 def usage():
 	print("Clone Hero Chart to SM converter {}".format(VERSION))
-	print("Usage: {} [chart]".format(sys.argv[0]))
+	print("Usage: {} [-j JOBS] [-f] [-q] [--scan-threads N] [--readers N] [--timeout SECONDS] [--max-memory MB] [--job-file FILE] [--instruments LIST] [--cache DIR] [--keep-ir] [--profile FILE] [chart]".format(sys.argv[0]))
+	print("       {} --serve ADDRESS [-j JOBS] [--instruments LIST] [--cache DIR]".format(sys.argv[0]))
+	print("       {} --cache DIR [--cache-size MB] [--cache-info] [--cache-prune]".format(sys.argv[0]))
 	print("where [chart] is a .chart or .mid file, or a folder containing CH charts")
 	print("Outputs a \"notes.ssc\" file in the same folder as the chart")
+	print("Options:")
+	print("  -j, --jobs JOBS   convert a folder of charts with JOBS worker processes (0 = one per CPU)")
+	print("  -f, --force       reconvert every chart in a folder, even if unchanged since the last scan")
+	print("  -q, --quiet       only print failures & a summary when converting a folder")
+	print("  --scan-threads N  list up to N folders at once while scanning, for network drives")
+	print("  --readers N       read up to N charts at once ahead of the jobs, which leave writing simfiles to one thread")
+	print("  --timeout SECONDS give up on a chart in a folder after SECONDS")
+	print("  --max-memory MB   give up on a chart in a folder once it uses more than MB of memory")
+	print("  --job-file FILE   resume the charts in FILE, a crawl saved by --job-file or a list of chart paths,")
+	print("                    or crawl the [chart] folder into a new FILE; progress is checkpointed next to it")
+	print("  --instruments LIST convert every listed instrument the chart has, each to its own NOTEDATA, e.g. guitar,bass=bass-six")
+	print("                    instruments are {} or all; the STEPSTYPE after = is {} by default".format(", ".join(INSTRUMENT_NAMES), DEFAULT_STEPSTYPE))
+	print("                    without it, only the guitar part, or a .mid's first guitar, rhythm or bass part, is converted")
+	print("  --serve ADDRESS   convert charts sent by chart-to-sm-client.py to a UNIX socket path or localhost:PORT")
+	print("  --keep-ir         save each parsed chart next to it, e.g. notes.chart.ir, & reuse it while the chart is unchanged")
+	print("  --cache DIR       reuse simfiles of identical charts converted before, stored in DIR")
+	print("  --cache-size MB   limit the cache to MB, removing the least recently used simfiles (default 1000)")
+	print("  --cache-info      show the number & size of cached simfiles")
+	print("  --cache-prune     remove the least recently used simfiles until the cache fits --cache-size")
+	print("  --profile FILE    append a JSON line of per-stage timings & sizes for each chart to FILE")
 	sys.exit(1)
 
-def handle_file(infile):
+def handle_file(infile, file_names=None, verbose=True, contents=None):
+	# convert a chart file to a notes.ssc next to it, using the song.ini & audio in its folder
+	# file_names optionally lists the FOLDER_FILES in the folder, as found by crawl_library
+	# verbose prints which chart is being converted, batch runs report progress instead
+	# contents is an optional dict to put the bytes of the chart & song.ini in by file name, for folder_fingerprint
 	infile_name, infile_ext = os.path.splitext(os.path.basename(infile))
-	if os.path.isfile(infile):
-		parent_name = os.path.dirname(os.path.realpath(infile))
-		if infile_ext.lower() == MID_EXT:
-			print("Converting .mid for {}".format(parent_name))
-			return mid_to_sm(infile)
-		elif infile_ext.lower() == CHART_EXT:
-			print("Converting .chart for {}".format(parent_name))
-			return chart_to_sm(infile)
+	if infile_ext.lower() in (MID_EXT, CHART_EXT) and (file_names != None or os.path.isfile(infile)):
+		in_folder = os.path.dirname(os.path.abspath(infile))
+		if verbose:
+			print("Converting {} for {}".format(infile_ext.lower(), os.path.dirname(os.path.realpath(infile))))
+		with profile_stage("chart") as chart_stats:
+			chart_stats["chart"] = os.path.abspath(infile)
+			with profile_stage("read_song_ini") as stats:
+				with open(os.path.join(in_folder, SONG_INI), "rb") as songini_file:
+					song_ini = songini_file.read()
+				stats["bytes_read"] = len(song_ini)
+			song_file = find_song_file(in_folder, file_names)
+			chart, chart_ext, sidecar = read_chart(infile, infile_ext)
+			if contents != None:
+				contents[os.path.basename(infile)] = chart
+				contents[SONG_INI] = song_ini
+			chart_stats["result"] = write_chart(os.path.join(in_folder, SSC_NAME), chart, chart_ext, song_ini, song_file, sidecar)
+		return chart_stats["result"]
 	return 1
 
-def scan_folder(in_folder):
-	# scan subdirectories
-	for f in os.listdir("."):
-		if os.path.isdir(f):
-			os.chdir(f)
-			scan_folder(f)
-			os.chdir("..")
+def list_folder(in_folder):
+	# list a folder with a single os.scandir, returns (subfolders, crawl job or None)
+	# a job is {"folder": path, "chart": path of the notes.mid or notes.chart, "files": FOLDER_FILES present in the folder}
+	folder_files = {os.path.normcase(name): name for name in FOLDER_FILES}
+	file_names = set()
+	subfolders = []
+	try:
+		with os.scandir(in_folder) as entries:
+			for entry in entries:
+				if entry.is_dir():
+					subfolders.append(entry.path)
+				elif os.path.normcase(entry.name) in folder_files and entry.is_file():
+					file_names.add(folder_files[os.path.normcase(entry.name)])
+	except OSError:
+		traceback.print_exc()
+		print("Warning: failed to scan {}".format(in_folder))
+		return [], None
+
+	for chart_name in (NOTES_NAME+MID_EXT, NOTES_NAME+CHART_EXT):
+		if chart_name in file_names:
+			return subfolders, {"folder": in_folder, "chart": os.path.join(in_folder, chart_name), "files": frozenset(file_names)}
+	return subfolders, None
+
+def crawl_library(in_folder):
+	# walk in_folder one folder at a time, yielding a job for every chart folder, subfolders first
+	subfolders, job = list_folder(in_folder)
+	for subfolder in subfolders:
+		yield from crawl_library(subfolder)
+	if job != None:
+		yield job
+
+def crawl_library_threaded(in_folder, threads):
+	# walk in_folder listing up to threads folders at once, for filesystems with slow metadata access
+	# jobs are yielded as soon as their folder is listed, in no particular order
+	with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+		pending = {executor.submit(list_folder, in_folder)}
+		while len(pending) > 0:
+			done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				subfolders, job = future.result()
+				for subfolder in subfolders:
+					pending.add(executor.submit(list_folder, subfolder))
+				if job != None:
+					yield job
+
+def convert_job(job, quiet=False):
+	# convert the chart of a crawl_library job, returns (folder, result, traceback or None, the converter's messages, fingerprint)
+	# the messages are printed by the parent, so they don't cut into its progress line; quiet discards them
+	# the fingerprint of the folder hashes the files as they were read for the conversion, None if it failed
+	messages = io.StringIO()
+	try:
+		contents = {}
+		with contextlib.redirect_stdout(messages):
+			result = handle_file(job["chart"], job["files"], False, contents)
+		fingerprint = folder_fingerprint(job["folder"], None, job["files"], contents) if result == 0 else None
+		return job["folder"], result, None, "" if quiet else messages.getvalue(), fingerprint
+	except KeyboardInterrupt:
+		# stop the batch instead of failing the chart, so a job file resumes at it
+		raise
+	except:
+		return job["folder"], 1, traceback.format_exc(), "" if quiet else messages.getvalue()
+
+def convert_jobs(jobs, quiet=False):
+	# convert a chunk of jobs in a worker process
+	return [convert_job(job, quiet) for job in jobs]
+
+def init_worker(profile=None, cache=None, keep_ir=False, stepstypes=None):
+	# set up a batch or server worker process like its parent, which spawned workers don't inherit
+	if profile != None:
+		profile_to_file(profile)
+	set_conversion_cache(cache)
+	set_ir_sidecars(keep_ir)
+	set_instrument_stepstypes(stepstypes)
+
+def chart_worker(conn, quiet=False, profile=None, cache=None, keep_ir=False, stepstypes=None):
+	# worker process for convert_jobs_limited, converts jobs from conn until it gets None
+	init_worker(profile, cache, keep_ir, stepstypes)
+	while True:
+		job = conn.recv()
+		if job == None:
+			break
+		conn.send(convert_job(job, quiet))
+
+def process_rss(pid):
+	# resident memory of a process in bytes, None if it can't be measured here
+	if psutil != None:
+		try:
+			return psutil.Process(pid).memory_info().rss
+		except psutil.Error:
+			return None
+	try:
+		with open("/proc/{}/statm".format(pid), "r") as statm:
+			return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, AttributeError):
+		return None
+
+class ChartWorker:
+	# a worker process converting one chart at a time, so a chart that hangs or bloats can be killed
+	def __init__(self, quiet=False, profile=None):
+		self.quiet = quiet
+		self.profile = profile
+		self.job = None
+		self.start()
+
+	def start(self):
+		self.conn, worker_conn = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=chart_worker, args=(worker_conn, self.quiet, self.profile, conversion_cache, ir_sidecars, instrument_stepstypes), daemon=True)
+		self.process.start()
+		worker_conn.close()
+
+	def submit(self, job):
+		self.job = job
+		self.started = time.perf_counter()
+		self.conn.send(job)
+
+	def result(self):
+		# the finished job's convert_job result, restarting the worker if it died
+		job, self.job = self.job, None
+		try:
+			return self.conn.recv()
+		except (EOFError, OSError):
+			self.process.join(1)
+			# restarting replaces the process, so keep how the dead one exited
+			exitcode = self.process.exitcode
+			self.restart()
+			return job["folder"], 1, "Error: worker exited with code {}\n".format(exitcode), ""
+
+	def over_limit(self, timeout, max_memory):
+		# an error message if the current job is over the time or memory limit, else None
+		if timeout != None and time.perf_counter() - self.started > timeout:
+			return "Error: conversion took longer than {}s\n".format(timeout)
+		if max_memory != None:
+			rss = process_rss(self.process.pid)
+			if rss != None and rss > max_memory:
+				return "Error: conversion used more than {} MB of memory\n".format(max_memory // 1000000)
+		return None
+
+	def restart(self):
+		self.kill()
+		self.start()
+
+	def kill(self):
+		self.conn.close()
+		self.process.kill()
+		self.process.join()
+
+	def stop(self):
+		# let the worker exit on its own, killing it if it's busy or stuck
+		if self.job == None:
+			try:
+				self.conn.send(None)
+				self.process.join(1)
+			except OSError:
+				pass
+		if self.process.is_alive():
+			self.kill()
+		else:
+			self.conn.close()
+
+def convert_jobs_limited(jobs, workers=1, timeout=None, max_memory=None, quiet=False, profile=None):
+	# convert jobs in worker processes, yielding convert_job results as they finish
+	# a chart taking longer than timeout seconds or more than max_memory bytes of RSS is killed & fails,
+	# and its worker is replaced
+	if max_memory != None and process_rss(os.getpid()) == None:
+		print("Warning: can't measure memory use here without psutil, ignoring the memory limit")
+		max_memory = None
+	jobs = iter(jobs)
+	jobs_left = True
+	pool = [ChartWorker(quiet, profile) for i in range(workers)]
+	try:
+		while True:
+			for worker in pool:
+				if worker.job == None and jobs_left:
+					job = next(jobs, None)
+					if job == None:
+						jobs_left = False
+					else:
+						worker.submit(job)
+			busy = [worker for worker in pool if worker.job != None]
+			if len(busy) == 0:
+				break
+
+			ready = multiprocessing.connection.wait([worker.conn for worker in busy], WORKER_POLL_INTERVAL)
+			for worker in busy:
+				if worker.conn in ready:
+					yield worker.result()
+				else:
+					error = worker.over_limit(timeout, max_memory)
+					if error != None:
+						folder = worker.job["folder"]
+						worker.job = None
+						worker.restart()
+						yield folder, 1, error, ""
+	finally:
+		for worker in pool:
+			worker.stop()
+
+def read_job(job, job_filter=None):
+	# read the chart & song.ini of a crawl job for a pipelined batch, returns (chart bytes, song.ini bytes)
+	# job_filter(job, {file name: bytes}) can check the files once they're read, None is returned if it's False
+	with open(job["chart"], "rb") as chartfile:
+		chart = chartfile.read()
+	song_ini = None
+	if SONG_INI in job["files"]:
+		with open(os.path.join(job["folder"], SONG_INI), "rb") as songini_file:
+			song_ini = songini_file.read()
+	if job_filter != None:
+		contents = {os.path.basename(job["chart"]): chart}
+		if song_ini != None:
+			contents[SONG_INI] = song_ini
+		if not job_filter(job, contents):
+			return None
+	if song_ini == None:
+		raise FileNotFoundError("no {} in {}".format(SONG_INI, job["folder"]))
+	return chart, song_ini
+
+def convert_job_bytes(job, chart, song_ini, quiet=False):
+	# convert a job's chart from the bytes read by read_job, in a pipelined batch worker
+	# returns a convert_job result & the .ssc text or None, the parent writes the .ssc
+	messages = io.StringIO()
+	try:
+		ssc_file = io.StringIO()
+		with contextlib.redirect_stdout(messages):
+			with profile_stage("chart") as chart_stats:
+				chart_stats["chart"] = job["chart"]
+				song_file = find_song_file(job["folder"], job["files"])
+				sidecar = job["chart"] + IR_SIDECAR_EXT if ir_sidecars else None
+				chart_stats["result"] = write_chart(ssc_file, chart, os.path.splitext(job["chart"])[1], song_ini, song_file, sidecar)
+		messages = "" if quiet else messages.getvalue()
+		if chart_stats["result"] != 0:
+			return job["folder"], chart_stats["result"], None, messages, None
+		return job["folder"], 0, None, messages, ssc_file.getvalue()
+	except KeyboardInterrupt:
+		raise
+	except:
+		return job["folder"], 1, traceback.format_exc(), "" if quiet else messages.getvalue(), None
+
+def convert_jobs_pipelined(jobs, workers=1, readers=1, quiet=False, profile=None, job_filter=None, reads_done=None):
+	# convert jobs in three overlapping stages, yielding convert_job results as simfiles are written:
+	# reader threads prefetch chart & song.ini bytes, worker processes convert them & a writer thread writes the simfiles
+	# the stages are connected by bounded queues, so a slow stage holds back the ones before it
+	# job_filter is passed to read_job, jobs it rejects are left out; reads_done is called once every job has been read
+	queue_size = workers * PIPELINE_QUEUE_PER_WORKER
+	read_queue = queue.Queue(queue_size)
+	convert_queue = queue.Queue(queue_size)
+	done_queue = queue.Queue()
+	stop = threading.Event()
+	crawl_error = []
+
+	def put(stage_queue, item):
+		# give up once the batch is stopped, so a stage can't block on a full queue forever
+		while not stop.is_set():
+			try:
+				stage_queue.put(item, timeout=WORKER_POLL_INTERVAL)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def get(stage_queue):
+		while not stop.is_set():
+			try:
+				return stage_queue.get(timeout=WORKER_POLL_INTERVAL)
+			except queue.Empty:
+				pass
+		return None
+
+	def feed(reader_pool):
+		# stage 1: start reading jobs in order as the crawl finds them
+		try:
+			for job in jobs:
+				if not put(read_queue, (job, reader_pool.submit(read_job, job, job_filter))):
+					return
+		except BaseException as e:
+			# raised again by the main thread
+			crawl_error.append(e)
+		put(read_queue, None)
+
+	def dispatch(executor):
+		# stage 2: hand read charts to the worker processes
+		while True:
+			item = get(read_queue)
+			if item == None:
+				break
+			job, read_future = item
+			try:
+				job_files = read_future.result()
+				if job_files == None:
+					continue
+				convert_future = executor.submit(convert_job_bytes, job, job_files[0], job_files[1], quiet)
+			except:
+				convert_future = concurrent.futures.Future()
+				convert_future.set_result((job["folder"], 1, traceback.format_exc(), "", None))
+			if not put(convert_queue, (job, convert_future)):
+				return
+		if reads_done != None and not stop.is_set():
+			reads_done()
+		put(convert_queue, None)
+
+	def write():
+		# stage 3: write the converted simfiles
+		while True:
+			item = get(convert_queue)
+			if item == None:
+				break
+			job, convert_future = item
+			try:
+				folder, result, error, messages, sm_text = convert_future.result()
+				if sm_text != None:
+					with open(os.path.join(folder, SSC_NAME), "w", encoding="utf-8") as ssc_file:
+						ssc_file.write(sm_text)
+			except:
+				folder, result, error, messages = job["folder"], 1, traceback.format_exc(), ""
+			done_queue.put((folder, result, error, messages))
+		done_queue.put(None)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=readers) as reader_pool, \
+			concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(profile, conversion_cache, ir_sidecars, instrument_stepstypes)) as executor:
+		stages = [threading.Thread(target=feed, args=(reader_pool,), daemon=True),
+			threading.Thread(target=dispatch, args=(executor,), daemon=True),
+			threading.Thread(target=write, daemon=True)]
+		for stage in stages:
+			stage.start()
+		try:
+			while True:
+				result = done_queue.get()
+				if result == None:
+					break
+				yield result
+		finally:
+			stop.set()
+			for stage in stages:
+				stage.join()
+			if len(crawl_error) > 0:
+				raise crawl_error[0]
+
+def format_duration(seconds):
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+
+class BatchProgress:
+	# reports charts & MB per second, completed & failed counts & the ETA of a batch conversion
+	# the total grows as the crawl finds charts, so the ETA firms up once the crawl is done
+	# updates are rate limited, quiet only prints the final summary
+	def __init__(self, quiet=False, out=None):
+		self.quiet = quiet
+		self.out = out if out != None else sys.stdout
+		self.console = self.out.isatty()
+		self.interval = PROGRESS_INTERVAL if self.console else PROGRESS_LOG_INTERVAL
+		# batch workers report back from the executor's thread
+		self.lock = threading.Lock()
+		self.start = time.perf_counter()
+		self.last_update = self.start
+		self.crawling = True
+		self.chart_sizes = {}
+		self.found = 0
+		self.completed = 0
+		self.failed = 0
+		self.bytes_done = 0
+		self.line_length = 0
+
+	def job_found(self, job, size):
+		# a changed chart folder was found by the crawl, size is its chart file's size
+		with self.lock:
+			self.chart_sizes[job["folder"]] = size
+			self.found += 1
+			self.update()
+
+	def crawl_done(self):
+		with self.lock:
+			self.crawling = False
+
+	def job_done(self, folder, result, messages=""):
+		# messages are the converter's output for the chart, printed above the status line
+		with self.lock:
+			self.completed += 1
+			if result != 0:
+				self.failed += 1
+			self.bytes_done += self.chart_sizes.pop(folder, 0)
+			if len(messages) > 0:
+				if self.console and self.line_length > 0:
+					self.out.write("\r" + " " * self.line_length + "\r")
+					self.line_length = 0
+				self.out.write(messages)
+				# put the status back under the messages on a console
+				self.update(self.console)
+			else:
+				self.update()
+
+	def status(self):
+		elapsed = max(time.perf_counter() - self.start, 1e-9)
+		charts_per_sec = self.completed / elapsed
+		status = "{}/{}{} charts, {} failed, {:.1f} charts/s, {:.2f} MB/s".format(self.completed, self.found,
+			"+" if self.crawling else "", self.failed, charts_per_sec, self.bytes_done / elapsed / 1000000)
+		if self.completed > 0:
+			status += ", ETA {}{}".format(format_duration((self.found - self.completed) / charts_per_sec), "+" if self.crawling else "")
+		return status
+
+	def update(self, force=False):
+		# print the status if it's been long enough since the last update
+		if self.quiet:
+			return
+		now = time.perf_counter()
+		if not force and now - self.last_update < self.interval:
+			return
+		self.last_update = now
+		status = self.status()
+		if self.console:
+			# overwrite the last status, padding out any leftover characters
+			self.out.write("\r" + status.ljust(self.line_length))
+			self.line_length = len(status)
+		else:
+			self.out.write(status + "\n")
+		self.out.flush()
+
+	def finish(self):
+		# end the status line & print the totals
+		with self.lock:
+			if not self.quiet and self.console and self.line_length > 0:
+				self.out.write("\n")
+			elapsed = time.perf_counter() - self.start
+			self.out.write("Finished in {}, {:.1f} charts/s, {:.2f} MB/s\n".format(format_duration(elapsed),
+				self.completed / max(elapsed, 1e-9), self.bytes_done / max(elapsed, 1e-9) / 1000000))
+			self.out.flush()
+
+def file_fingerprint(infile, old_fingerprint=None, hash_content=True, content=None):
+	# [size, mtime, content hash] of a file, or None if it doesn't exist
+	# the file is never read here: the old hash is reused when size & mtime are unchanged,
+	# else content, the file's bytes if they've been read for converting it, is hashed & without it there's no hash
 	try:
-		if os.path.isfile(NOTES_NAME+MID_EXT):
-			handle_file(NOTES_NAME+MID_EXT)
-		elif os.path.isfile(NOTES_NAME+CHART_EXT):
-			handle_file(NOTES_NAME+CHART_EXT)
+		stat = os.stat(infile)
+	except OSError:
+		return None
+	fingerprint = [stat.st_size, stat.st_mtime_ns]
+	if hash_content:
+		if old_fingerprint != None and len(old_fingerprint) == 3 and old_fingerprint[:2] == fingerprint:
+			fingerprint.append(old_fingerprint[2])
+		elif content != None:
+			fingerprint.append(hashlib.sha1(content).hexdigest())
+	return fingerprint
+
+def folder_fingerprint(in_folder, old_fingerprint=None, file_names=None, contents=None):
+	# fingerprint the chart, song.ini & audio files of a chart folder
+	# audio files are only stat'd, since they're large & only their name ends up in the simfile
+	# file_names optionally lists the FOLDER_FILES in the folder, so missing files aren't stat'd
+	# contents optionally maps file names to bytes already read, which are hashed instead of reading them again
+	if old_fingerprint == None:
+		old_fingerprint = {}
+	if contents == None:
+		contents = {}
+	fingerprint = {}
+	for name in (NOTES_NAME+MID_EXT, NOTES_NAME+CHART_EXT, SONG_INI) + SONG_FILES:
+		if file_names != None and name not in file_names:
+			continue
+		file_print = file_fingerprint(os.path.join(in_folder, name), old_fingerprint.get(name), name not in SONG_FILES, contents.get(name))
+		if file_print != None:
+			fingerprint[name] = file_print
+	return fingerprint
+
+def fingerprint_unchanged(fingerprint, old_fingerprint):
+	if old_fingerprint == None or fingerprint.keys() != old_fingerprint.keys():
+		return False
+	for name, file_print in fingerprint.items():
+		old_file_print = old_fingerprint[name]
+		if len(file_print) == 3 and len(old_file_print) == 3:
+			# hashed file, compare size & contents
+			if file_print[0] != old_file_print[0] or file_print[2] != old_file_print[2]:
+				return False
+		elif file_print[:2] != old_file_print[:2]:
+			# a file without a hash yet is compared by size & mtime
+			return False
+	return True
+
+def load_manifest(in_folder, stepstypes):
+	# returns {folder relative to in_folder: fingerprint}, empty if missing, from another converter version
+	# or converting other instruments than stepstypes, as in convert_instruments, or with other render_settings
+	try:
+		with open(os.path.join(in_folder, MANIFEST_NAME), "r", encoding="utf-8") as manifest_file:
+			manifest = json.load(manifest_file)
+		if manifest.get("version") == VERSION and manifest.get("instruments") == stepstypes and manifest.get("settings") == render_settings():
+			return manifest.get("folders", {})
+	except FileNotFoundError:
+		pass
 	except:
 		traceback.print_exc()
-		print("Failed to process chart in {}".format(in_folder))
+		print("Warning: ignoring unreadable {}".format(MANIFEST_NAME))
+	return {}
+
+def save_manifest(in_folder, folders, stepstypes):
+	manifest_path = os.path.join(in_folder, MANIFEST_NAME)
+	with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+		json.dump({"version": VERSION, "instruments": stepstypes, "settings": render_settings(), "folders": folders}, manifest_file, sort_keys=True)
+	os.replace(manifest_path + ".tmp", manifest_path)
+
+def chart_job(chart):
+	# crawl job for an explicitly listed chart file, None if it isn't in a readable folder
+	chart = os.path.abspath(chart)
+	if not os.path.isfile(chart):
+		print("Warning: skipping missing chart {}".format(chart))
+		return None
+	subfolders, job = list_folder(os.path.dirname(chart))
+	if job == None or os.path.basename(chart) not in job["files"]:
+		print("Warning: skipping missing chart {}".format(chart))
+		return None
+	return dict(job, chart=chart)
+
+def save_job_file(job_file, in_folder, jobs):
+	# save a crawl of in_folder, so a batch can be resumed without crawling again
+	with open(job_file + ".tmp", "w", encoding="utf-8") as jobs_out:
+		json.dump({"version": VERSION, "root": in_folder,
+			"jobs": [{"folder": job["folder"], "chart": job["chart"], "files": sorted(job["files"])} for job in jobs]}, jobs_out, indent=1)
+	os.replace(job_file + ".tmp", job_file)
+
+def load_job_file(job_file):
+	# returns (root folder or None, crawl jobs) from a saved crawl,
+	# or from a text file listing a chart path per line, where the root is None
+	with open(job_file, "rb") as jobs_in:
+		text = decode_text(jobs_in.read())[0]
+	try:
+		saved = json.loads(text)
+	except ValueError:
+		saved = None
+	if isinstance(saved, dict):
+		return saved.get("root"), [dict(job, files=frozenset(job["files"])) for job in saved["jobs"]]
+	jobs = []
+	for line in text.splitlines():
+		line = line.strip()
+		if len(line) > 0 and not line.startswith("#"):
+			job = chart_job(line)
+			if job != None:
+				jobs.append(job)
+	return None, jobs
+
+class JobCheckpoint:
+	# the folders of a job file that are done or failed, saved next to it every CHECKPOINT_INTERVAL seconds
+	def __init__(self, job_file, resume=True):
+		self.path = job_file + ".checkpoint"
+		self.lock = threading.Lock()
+		self.done = set()
+		self.failed = set()
+		if resume:
+			try:
+				with open(self.path, "r", encoding="utf-8") as checkpoint_file:
+					checkpoint = json.load(checkpoint_file)
+				self.done = set(checkpoint["done"])
+				self.failed = set(checkpoint["failed"])
+			except FileNotFoundError:
+				pass
+			except:
+				traceback.print_exc()
+				print("Warning: ignoring unreadable {}".format(self.path))
+		self.last_save = time.perf_counter()
+
+	def finished(self, folder):
+		return folder in self.done or folder in self.failed
+
+	def add(self, folder, result):
+		with self.lock:
+			if result == 0:
+				self.done.add(folder)
+				self.failed.discard(folder)
+			else:
+				self.failed.add(folder)
+			if time.perf_counter() - self.last_save >= CHECKPOINT_INTERVAL:
+				self.save()
+
+	def save(self):
+		self.last_save = time.perf_counter()
+		with open(self.path + ".tmp", "w", encoding="utf-8") as checkpoint_file:
+			json.dump({"version": VERSION, "done": sorted(self.done), "failed": sorted(self.failed)}, checkpoint_file)
+		os.replace(self.path + ".tmp", self.path)
+
+def scan_folder(in_folder, jobs=1, force=False, scan_threads=1, profile=None, quiet=False, timeout=None, max_memory=None, job_file=None, readers=None):
+	# profile is a file to append a JSON line of stage timings to for each converted chart
+	# quiet hides progress & the converter's warnings, only printing failures & the summary
+	# with a timeout (seconds) or max_memory (bytes), each chart is converted in a worker process that's killed past them
+	# job_file is a crawl saved by an earlier run or a list of chart paths, where converted & failed charts are checkpointed
+	# if it doesn't exist, in_folder is crawled into it; force restarts it from scratch
+	# readers is a number of threads to read charts ahead of the worker processes, which then leave writing simfiles to the parent
+	progress = BatchProgress(quiet)
+	checkpoint = None
+	if job_file != None and os.path.exists(job_file):
+		in_folder, crawl = load_job_file(job_file)
+		checkpoint = JobCheckpoint(job_file, not force)
+		finished = sum(1 for job in crawl if checkpoint.finished(job["folder"]))
+		print("Resuming {}: {} of {} charts already done".format(job_file, finished, len(crawl)))
+	else:
+		in_folder = os.path.abspath(in_folder)
+		if scan_threads > 1:
+			crawl = crawl_library_threaded(in_folder, scan_threads)
+		else:
+			crawl = crawl_library(in_folder)
+		if job_file != None:
+			# the whole crawl is saved before converting, so it never has to be repeated
+			crawl = list(crawl)
+			save_job_file(job_file, in_folder, crawl)
+			checkpoint = JobCheckpoint(job_file, False)
+
+	# skip folders whose chart, song.ini & audio are unchanged since the last conversion
+	# a list of charts has no root folder to keep a manifest in
+	manifest = {} if force or in_folder == None else load_manifest(in_folder, instrument_stepstypes)
+	fingerprints = {}
+	new_manifest = {}
+	# entries of folders an interrupted job file run already finished, which aren't scanned again
+	resumed_manifest = {}
+	def manifest_key(folder):
+		return os.path.relpath(folder, in_folder) if in_folder != None else folder
+	def job_changed(job, contents=None):
+		# fingerprint a job's folder, False if it's unchanged & goes in the manifest as it is
+		# contents are files already read, see folder_fingerprint, otherwise files are only stat'd
+		# & a changed folder's fingerprint comes with its conversion's result
+		folder = job["folder"]
+		key = manifest_key(folder)
+		fingerprints[folder] = folder_fingerprint(folder, manifest.get(key), job["files"], contents)
+		if fingerprint_unchanged(fingerprints[folder], manifest.get(key)) and SSC_NAME in job["files"]:
+			new_manifest[key] = fingerprints[folder]
+			return False
+		chart_print = fingerprints[folder].get(os.path.basename(job["chart"]))
+		progress.job_found(job, chart_print[0] if chart_print != None else 0)
+		return True
+	def changed_jobs(check=True):
+		# without check, jobs are fingerprinted later with job_changed, after which progress.crawl_done has to be called
+		for job in crawl:
+			folder = job["folder"]
+			key = manifest_key(folder)
+			if checkpoint != None and checkpoint.finished(folder):
+				if key in manifest:
+					resumed_manifest[key] = manifest[key]
+				continue
+			if not check or job_changed(job):
+				yield job
+		if check:
+			progress.crawl_done()
+	def job_done(folder, result, error=None, messages="", fingerprint=None):
+		# a convert_job result, from the main thread or the executor's
+		if fingerprint != None:
+			fingerprints[folder] = fingerprint
+		results.append((folder, result, error))
+		progress.job_done(folder, result, messages)
+		if checkpoint != None:
+			checkpoint.add(folder, result)
+
+	# conversion starts as soon as the crawl finds changed charts
+	results = []
+	if jobs == 0:
+		jobs = os.cpu_count() or 1
+	try:
+		if timeout != None or max_memory != None:
+			for result in convert_jobs_limited(changed_jobs(), jobs, timeout, max_memory, quiet, profile):
+				job_done(*result)
+		elif readers != None:
+			# the reader threads fingerprint the charts they read, so the crawl doesn't read each one first
+			for result in convert_jobs_pipelined(changed_jobs(False), jobs, readers, quiet, profile, job_changed, progress.crawl_done):
+				job_done(*result)
+		elif jobs > 1:
+			# workers add their own profiling hook & cache, so they work the same when spawned
+			def new_executor():
+				return concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(profile, conversion_cache, ir_sidecars, instrument_stepstypes))
+			def chunk_failed(chunk, error):
+				error = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+				for job in chunk:
+					job_done(job["folder"], 1, error)
+			def retry_jobs(chunks):
+				# convert the charts of chunks a dead worker broke the pool on again, one at a time in a new pool,
+				# so only a chart that kills its worker again fails & the rest of the batch goes on
+				nonlocal executor
+				executor.shutdown()
+				executor = new_executor()
+				for chunk in chunks:
+					for job in chunk:
+						try:
+							results = executor.submit(convert_jobs, [job], quiet).result()
+						except concurrent.futures.BrokenExecutor as e:
+							executor.shutdown()
+							executor = new_executor()
+							chunk_failed([job], e)
+							continue
+						for result in results:
+							job_done(*result)
+			def chunk_finished(future, chunk, broken):
+				if future.exception() == None:
+					for result in future.result():
+						job_done(*result)
+				elif isinstance(future.exception(), concurrent.futures.BrokenExecutor):
+					# a worker died, e.g. killed for using too much memory, which fails every chunk in the pool
+					broken.append(chunk)
+				else:
+					chunk_failed(chunk, future.exception())
+			def wait_chunks(limit):
+				# report chunks as they finish, until fewer than limit are left in the pool
+				while len(running) > 0 and len(running) >= limit:
+					done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+					broken = []
+					for future in done:
+						chunk_finished(future, running.pop(future), broken)
+					if len(broken) > 0:
+						# the broken pool fails the chunks left in it too, which are all retried
+						for future in concurrent.futures.wait(running).done:
+							chunk_finished(future, running.pop(future), broken)
+						retry_jobs(broken)
+			def submit_chunk(chunk):
+				try:
+					future = executor.submit(convert_jobs, chunk, quiet)
+				except concurrent.futures.BrokenExecutor as e:
+					# the pool broke before the chunk was sent, so it's retried like the chunks that were
+					future = concurrent.futures.Future()
+					future.set_exception(e)
+				running[future] = chunk
+				# hand each worker one chunk at a time, so a broken pool only loses the chunks being converted
+				wait_chunks(jobs)
+			# hand each worker several folders at a time so small charts don't pay IPC per chart
+			executor = new_executor()
+			running = {}
+			try:
+				chunk = []
+				for job in changed_jobs():
+					chunk.append(job)
+					if len(chunk) == BATCH_CHUNK_SIZE:
+						submit_chunk(chunk)
+						chunk = []
+				if len(chunk) > 0:
+					submit_chunk(chunk)
+				wait_chunks(1)
+			finally:
+				executor.shutdown()
+		else:
+			profile_hook = profile_to_file(profile) if profile != None else None
+			try:
+				for job in changed_jobs():
+					job_done(*convert_job(job, quiet))
+			finally:
+				if profile_hook != None:
+					remove_profile_hook(profile_hook)
+	finally:
+		# an interrupted job file resumes from here
+		if checkpoint != None:
+			checkpoint.save()
+
+		# only successful conversions go in the manifest, which keeps them even if the batch stopped early
+		skipped = len(new_manifest)
+		new_manifest.update(resumed_manifest)
+		for folder, result, error in results:
+			if result == 0:
+				new_manifest[manifest_key(folder)] = fingerprints[folder]
+		if in_folder != None:
+			try:
+				save_manifest(in_folder, new_manifest, instrument_stepstypes)
+			except:
+				traceback.print_exc()
+				print("Warning: failed to write {}".format(MANIFEST_NAME))
+
+	progress.finish()
+
+	# report errors in the parent
+	failed = 0
+	for folder, result, error in results:
+		if error != None:
+			if not quiet:
+				print(error, end="")
+			print("Failed to process chart in {}".format(folder))
+		if result != 0:
+			failed += 1
+	if skipped > 0:
+		print("Skipped {} unchanged charts".format(skipped))
+	print("Converted {} of {} charts".format(len(results) - failed, len(results)))
+	return failed
+
+def send_message(sock, header, payload=b""):
+	header = dict(header, size=len(payload))
+	header_bytes = json.dumps(header).encode("utf-8")
+	sock.sendall(SERVER_HEADER.pack(len(header_bytes)) + header_bytes + payload)
+
+def recv_exactly(sock, size):
+	data = bytearray()
+	while len(data) < size:
+		chunk = sock.recv(min(size - len(data), 1 << 20))
+		if len(chunk) == 0:
+			raise EOFError("connection closed")
+		data += chunk
+	return bytes(data)
+
+def recv_message(sock):
+	# returns (header, payload), raising EOFError when the other end hangs up
+	header_size, = SERVER_HEADER.unpack(recv_exactly(sock, SERVER_HEADER.size))
+	header = json.loads(recv_exactly(sock, header_size).decode("utf-8"))
+	return header, recv_exactly(sock, header.get("size", 0))
+
+def serve_convert(path):
+	# convert a chart file to a notes.ssc next to it in a server worker, returns (result, messages)
+	messages = io.StringIO()
+	with contextlib.redirect_stdout(messages):
+		try:
+			result = handle_file(path)
+		except KeyboardInterrupt:
+			raise
+		except:
+			messages.write(traceback.format_exc())
+			result = 1
+	return result, messages.getvalue()
+
+def serve_convert_bytes(chart, chart_ext, song_ini, song_file):
+	# convert chart bytes in a server worker, returns (.ssc text or None, messages)
+	messages = io.StringIO()
+	with contextlib.redirect_stdout(messages):
+		try:
+			sm_text = convert_chart(chart, chart_ext, song_ini, song_file)
+		except KeyboardInterrupt:
+			raise
+		except:
+			messages.write(traceback.format_exc())
+			sm_text = None
+	return sm_text, messages.getvalue()
+
+class ConvertRequestHandler(socketserver.BaseRequestHandler):
+	# answers conversion requests on a connection until the client hangs up
+	# {"command": "convert", "path": chart path} converts to a notes.ssc next to the chart,
+	# {"command": "convert_bytes", "chart_ext": ".chart" or ".mid", "song_file": audio name} with the chart as the payload
+	# returns the .ssc as the payload, "song_ini" optionally gives the song.ini as a latin-1 string
+	# every reply has "status" (0 on success) & the converter's "messages"
+	def handle(self):
+		while True:
+			try:
+				request, payload = recv_message(self.request)
+			except (EOFError, ConnectionError):
+				return
+			except ValueError:
+				send_message(self.request, {"status": 1, "messages": "Error: malformed request\n"})
+				return
+
+			command = request.get("command")
+			executor = self.server.executor
+			reply = b""
+			try:
+				if command == "convert":
+					status, messages = executor.submit(serve_convert, request["path"]).result()
+				elif command == "convert_bytes":
+					song_ini = request.get("song_ini")
+					if song_ini != None:
+						song_ini = song_ini.encode("latin-1")
+					sm_text, messages = executor.submit(serve_convert_bytes, payload, request["chart_ext"], song_ini, request.get("song_file")).result()
+					status = 1 if sm_text == None else 0
+					if sm_text != None:
+						reply = sm_text.encode("utf-8")
+				elif command == "shutdown":
+					status, messages = 0, "Shutting down\n"
+					threading.Thread(target=self.server.shutdown).start()
+				else:
+					status, messages = 1, "Error: unknown command {}\n".format(command)
+			except KeyError as e:
+				status, messages = 1, "Error: request is missing {}\n".format(e)
+			except Exception:
+				status, messages = 1, traceback.format_exc()
+			send_message(self.request, {"status": status, "messages": messages}, reply)
+
+class ConvertTCPServer(socketserver.ThreadingTCPServer):
+	# restarting the server shouldn't have to wait for old connections to time out
+	allow_reuse_address = True
+
+def make_server(address):
+	# a threaded server on host:port (localhost only), or a UNIX socket path otherwise
+	host, sep, port = address.rpartition(":")
+	if port.isdigit():
+		host = host or "127.0.0.1"
+		if host not in ("127.0.0.1", "localhost"):
+			raise ValueError("the server only listens on localhost, not {}".format(host))
+		return ConvertTCPServer((host, int(port)), ConvertRequestHandler)
+	if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+		raise ValueError("UNIX sockets aren't supported here, use host:port")
+	if os.path.exists(address):
+		# remove the socket left behind by a server that's no longer running
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+			try:
+				probe.connect(address)
+				raise ValueError("a server is already listening on {}".format(address))
+			except ConnectionRefusedError:
+				os.remove(address)
+	return socketserver.ThreadingUnixStreamServer(address, ConvertRequestHandler)
+
+def serve(address, jobs=1):
+	# convert charts sent to address on a pool of jobs worker processes until interrupted or shut down
+	if jobs == 0:
+		jobs = os.cpu_count() or 1
+	server = make_server(address)
+	server.daemon_threads = True
+	try:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(None, conversion_cache, ir_sidecars, instrument_stepstypes)) as executor:
+			server.executor = executor
+			print("Serving on {} with {} workers".format(address, jobs))
+			sys.stdout.flush()
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+	finally:
+		server.server_close()
+		if server.address_family == getattr(socket, "AF_UNIX", None):
+			os.remove(address)
 
 def main():
 	# force utf-8 in stdout
@@ -482,26 +2156,115 @@ def main():
 		sys.stdout.reconfigure(encoding='utf-8')
 		sys.stderr.reconfigure(encoding='utf-8')
 
-	if len(sys.argv) < 2:
+	parser = argparse.ArgumentParser(add_help=False)
+	parser.add_argument("chart", nargs="?")
+	parser.add_argument("-j", "--jobs", type=int, default=1)
+	parser.add_argument("-f", "--force", action="store_true")
+	parser.add_argument("--scan-threads", type=int, default=1)
+	parser.add_argument("--readers", type=int)
+	parser.add_argument("--profile")
+	parser.add_argument("-q", "--quiet", action="store_true")
+	parser.add_argument("--timeout", type=float)
+	parser.add_argument("--max-memory", type=int)
+	parser.add_argument("--job-file")
+	parser.add_argument("--instruments")
+	parser.add_argument("--serve")
+	parser.add_argument("--cache")
+	parser.add_argument("--keep-ir", action="store_true")
+	parser.add_argument("--cache-size", type=int)
+	parser.add_argument("--cache-info", action="store_true")
+	parser.add_argument("--cache-prune", action="store_true")
+	parser.add_argument("-h", "--help", action="store_true")
+	args, unknown = parser.parse_known_args()
+	if args.help or unknown:
+		usage()
+	resume = args.job_file != None and os.path.isfile(args.job_file)
+	cache_command = args.cache_info or args.cache_prune
+	if args.chart == None and not resume and args.serve == None and not cache_command:
 		print("Error: not enough arguments")
 		usage()
-	
-	infile = sys.argv[1]
-	if os.path.isdir(infile):
+	if args.jobs < 0:
+		print("Error: invalid number of jobs {}".format(args.jobs))
+		usage()
+	if args.scan_threads < 1:
+		print("Error: invalid number of scan threads {}".format(args.scan_threads))
+		usage()
+	if args.readers != None and args.readers < 1:
+		print("Error: invalid number of readers {}".format(args.readers))
+		usage()
+	if args.timeout != None and args.timeout <= 0:
+		print("Error: invalid timeout {}".format(args.timeout))
+		usage()
+	if args.max_memory != None and args.max_memory <= 0:
+		print("Error: invalid memory limit {}".format(args.max_memory))
+		usage()
+	max_memory = args.max_memory * 1000000 if args.max_memory != None else None
+	if args.cache_size != None and args.cache_size < 0:
+		print("Error: invalid cache size {}".format(args.cache_size))
+		usage()
+	if cache_command and args.cache == None:
+		print("Error: --cache-info & --cache-prune need --cache")
+		usage()
+	if args.instruments != None:
+		try:
+			set_instrument_stepstypes(parse_instruments(args.instruments))
+		except ValueError as e:
+			print("Error: invalid instruments {}: {}".format(args.instruments, e))
+			usage()
+	set_ir_sidecars(args.keep_ir)
+	if args.cache != None:
+		set_conversion_cache(ConversionCache(args.cache, args.cache_size * 1000000 if args.cache_size != None else CACHE_MAX_SIZE))
+
+	if cache_command:
+		if args.cache_prune:
+			removed, removed_size = conversion_cache.prune()
+			print("Removed {} cached simfiles, {:.1f} MB".format(removed, removed_size / 1000000))
+		if args.cache_info:
+			entries = conversion_cache.entries()
+			print("Cache {}: {} simfiles, {:.1f} of {:.1f} MB".format(conversion_cache.folder, len(entries),
+				sum(size for last_used, size, path in entries) / 1000000, conversion_cache.max_size / 1000000))
+			if len(entries) > 0:
+				print("Least recently used {}, most recently used {}".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(entries[0][0])),
+					time.strftime("%Y-%m-%d %H:%M", time.localtime(entries[-1][0]))))
+		sys.exit(0)
+
+	if args.serve != None:
+		try:
+			serve(args.serve, args.jobs)
+		except (ValueError, OSError) as e:
+			print("Error: can't serve on {}: {}".format(args.serve, e))
+			sys.exit(1)
+		sys.exit(0)
+
+	infile = args.chart
+	if resume or (args.job_file != None and os.path.isdir(infile)):
+		# crawl into a new job file, or resume one
+		if not resume:
+			print("Scanning for charts to convert...")
+		scan_folder(infile, args.jobs, args.force, args.scan_threads, args.profile, args.quiet, args.timeout, max_memory, args.job_file, args.readers)
+		if conversion_cache != None:
+			conversion_cache.prune()
+		sys.exit(0)
+	elif os.path.isdir(infile):
 		# scan folder for charts
 		print("Scanning for charts to convert...")
-		os.chdir(infile)
-		scan_folder(infile)
+		scan_folder(infile, args.jobs, args.force, args.scan_threads, args.profile, args.quiet, args.timeout, max_memory, readers=args.readers)
+		if conversion_cache != None:
+			conversion_cache.prune()
 		sys.exit(0)
 	elif os.path.isfile(infile):
-		os.chdir(os.path.dirname(infile))
+		if args.profile != None:
+			profile_to_file(args.profile)
 		if handle_file(infile):
-			print("Error: unsupported chart {}".format(sys.argv[1]))
+			print("Error: unsupported chart {}".format(args.chart))
 			usage()
+		if conversion_cache != None:
+			conversion_cache.prune()
 	else:
-		print("Error: invalid chart path {}".format(sys.argv[1]))
+		print("Error: invalid chart path {}".format(args.chart))
 		usage()
 
 if __name__ == "__main__":
+	# needed for worker processes in the frozen .exe
+	multiprocessing.freeze_support()
 	main()
-
@@ -27,6 +27,7 @@ MIDI files:
 
     MidiFile(filename, **kwargs) -- open a MIDI file
     MidiTrack()  -- a MIDI track
+    UndecodedTrack  -- a track skipped by MidiFile(load_tracks=...)
     bpm2tempo()  -- convert beats per minute to MIDI file tempo
     tempo2bpm()  -- convert MIDI file tempo to beats per minute
     merge_tracks(tracks)  -- merge tracks into one track
@@ -97,7 +98,7 @@ from .messages import (Message, parse_string, parse_string_stream,
                        format_as_string, MIN_PITCHWHEEL, MAX_PITCHWHEEL,
                        MIN_SONGPOS, MAX_SONGPOS)
 from .parser import Parser, parse, parse_all
-from .midifiles import (MidiFile, MidiTrack, merge_tracks,
+from .midifiles import (MidiFile, MidiTrack, UndecodedTrack, merge_tracks,
                         MetaMessage, UnknownMetaMessage,
                         bpm2tempo, tempo2bpm, tick2second, second2tick,
                         KeySignatureError)
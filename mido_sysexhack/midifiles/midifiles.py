@@ -230,6 +230,237 @@ def read_track(infile, debug=False, clip=False):
     return track
 
 
+# Whole-buffer decoding. These mirror the read_*() functions above but
+# work on a bytearray holding the whole file and an integer offset
+# instead of calling file.read(1) for every byte. Each function returns
+# the decoded value and the offset after it.
+
+def _decode_bytes(data, pos, size):
+    if size > MAX_MESSAGE_LENGTH:
+        raise IOError('Message length {} exceeds maximum length {}'.format(
+            size, MAX_MESSAGE_LENGTH))
+    if size <= 0:
+        return [], pos
+    end = pos + size
+    if end > len(data):
+        raise EOFError
+    return list(data[pos:end]), end
+
+
+def _decode_byte(data, pos):
+    try:
+        return data[pos], pos + 1
+    except IndexError:
+        raise EOFError
+
+
+def _decode_variable_int(data, pos):
+    delta = 0
+
+    while True:
+        byte, pos = _decode_byte(data, pos)
+        delta = (delta << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return delta, pos
+
+
+def _decode_chunk_header(data, pos):
+    if pos + 8 > len(data):
+        raise EOFError
+
+    return struct.unpack_from('>4sL', data, pos), pos + 8
+
+
+def _decode_file_header(data):
+    (name, size), pos = _decode_chunk_header(data, 0)
+
+    if name != b'MThd':
+        raise IOError('MThd not found. Probably not a MIDI file')
+    elif min(size, len(data) - pos) < 6:
+        raise EOFError
+    else:
+        return struct.unpack_from('>hhh', data, pos), pos + size
+
+
+def _make_channel_specs():
+    # (type, value names, channel) for every channel message status
+    # byte except pitchwheel, which needs special decoding.
+    specs = {}
+    for status_byte, spec in SPEC_BY_STATUS.items():
+        if 0x80 <= status_byte < 0xe0:
+            names = tuple(name for name in spec['value_names']
+                          if name != 'channel')
+            specs[status_byte] = (spec['type'], names, status_byte & 0x0f)
+    return specs
+
+
+_CHANNEL_SPECS = _make_channel_specs()
+
+
+def _decode_message(data, pos, status_byte, peek_data, delta, clip=False):
+    try:
+        spec = SPEC_BY_STATUS[status_byte]
+    except LookupError:
+        raise IOError('undefined status byte 0x{:02x}'.format(status_byte))
+
+    # Subtract 1 for status byte.
+    size = spec['length'] - 1 - len(peek_data)
+    data_bytes, pos = _decode_bytes(data, pos, size)
+    data_bytes = peek_data + data_bytes
+
+    if clip:
+        data_bytes = [byte if byte < 127 else 127 for byte in data_bytes]
+    else:
+        for byte in data_bytes:
+            if byte > 127:
+                raise IOError('data byte must be in range 0..127')
+
+    channel_spec = _CHANNEL_SPECS.get(status_byte)
+    if channel_spec is not None:
+        # The data bytes are already checked, so build the message
+        # directly instead of decoding it again in Message.from_bytes().
+        msg_type, names, channel = channel_spec
+        msgdict = {'type': msg_type, 'time': delta}
+        msgdict.update(zip(names, data_bytes))
+        msgdict['channel'] = channel
+        msg = Message.__new__(Message)
+        vars(msg).update(msgdict)
+        return msg, pos
+
+    return Message.from_bytes([status_byte] + data_bytes, time=delta), pos
+
+
+def _decode_sysex(data, pos, delta):
+    length, pos = _decode_variable_int(data, pos)
+    sysex_data, pos = _decode_bytes(data, pos, length)
+
+    # Strip start and end bytes.
+    if sysex_data and sysex_data[0] == 0xf0:
+        sysex_data = sysex_data[1:]
+    if sysex_data and sysex_data[-1] == 0xf7:
+        sysex_data = sysex_data[:-1]
+
+    return Message('sysex', data=sysex_data, time=delta), pos
+
+
+def _decode_meta_message(data, pos, delta):
+    meta_type, pos = _decode_byte(data, pos)
+    length, pos = _decode_variable_int(data, pos)
+    meta_data, pos = _decode_bytes(data, pos, length)
+    return build_meta_message(meta_type, meta_data, delta), pos
+
+
+def decode_track(data, pos, clip=False):
+    """Decode the track chunk starting at offset pos in data.
+
+    Behaves exactly like read_track() on a file positioned at pos,
+    including the sysex running status hack. Returns the track and the
+    offset after the last message read.
+    """
+    track = MidiTrack()
+
+    (name, size), pos = _decode_chunk_header(data, pos)
+
+    if name != b'MTrk':
+        raise IOError('no MTrk header at start of track')
+
+    end = pos + size
+    last_status = None
+
+    # End of track reached.
+    while pos != end:
+        delta, pos = _decode_variable_int(data, pos)
+        status_byte, pos = _decode_byte(data, pos)
+
+        if status_byte < 0x80:
+            if last_status is None:
+                raise IOError('running status without last_status')
+            peek_data = [status_byte]
+            status_byte = last_status
+        else:
+            # HACK: don't set running status byte for sysex
+            if status_byte not in (0xff, 0xf0, 0xf7):
+                # Meta messages don't set running status.
+                last_status = status_byte
+            peek_data = []
+
+        if status_byte == 0xff:
+            msg, pos = _decode_meta_message(data, pos, delta)
+        elif status_byte in (0xf0, 0xf7):
+            msg, pos = _decode_sysex(data, pos, delta)
+        else:
+            msg, pos = _decode_message(data, pos, status_byte, peek_data,
+                                       delta, clip)
+
+        track.append(msg)
+
+    return track, pos
+
+
+def _decode_track_name(data, pos, end):
+    # Name from the track_name meta message among the meta messages at
+    # the start of a track, without decoding the rest of the track.
+    try:
+        while pos < end:
+            delta, pos = _decode_variable_int(data, pos)
+            status_byte, pos = _decode_byte(data, pos)
+            if status_byte != 0xff:
+                break
+
+            msg, pos = _decode_meta_message(data, pos, delta)
+            if msg.type == 'track_name':
+                return msg.name
+    except Exception:
+        pass
+
+    return ''
+
+
+def decode_track_directory(data, pos, num_tracks):
+    """Return (offset, size, name) for each track chunk starting at pos.
+
+    Only the chunk headers and the leading meta messages of each track
+    are read, so this is much cheaper than decoding the tracks.
+    """
+    directory = []
+
+    for i in range(num_tracks):
+        (name, size), body = _decode_chunk_header(data, pos)
+
+        if name != b'MTrk':
+            raise IOError('no MTrk header at start of track')
+        elif body + size > len(data):
+            raise EOFError
+
+        directory.append((pos, size, _decode_track_name(data, body,
+                                                        body + size)))
+        pos = body + size
+
+    return directory
+
+
+class UndecodedTrack(object):
+    """A track chunk skipped by MidiFile(load_tracks=...).
+
+    The chunk is kept as raw bytes. name is read from the track_name
+    meta message at the start of the track. Call decode() to get the
+    MidiTrack.
+    """
+    def __init__(self, name, data, charset='latin1', clip=False):
+        self.name = name
+        self.data = data
+        self.charset = charset
+        self.clip = clip
+
+    def decode(self):
+        with meta_charset(self.charset):
+            return decode_track(self.data, 0, clip=self.clip)[0]
+
+    def __repr__(self):
+        return '<undecoded midi track {!r} {} bytes>'.format(self.name,
+                                                            len(self.data))
+
+
 def write_chunk(outfile, name, data):
     """Write an IFF chunk to the file.
 
@@ -295,7 +526,8 @@ class MidiFile(object):
                  type=1, ticks_per_beat=DEFAULT_TICKS_PER_BEAT,
                  charset='latin1',
                  debug=False,
-                 clip=False
+                 clip=False,
+                 load_tracks=None
                  ):
 
         self.filename = filename
@@ -304,6 +536,9 @@ class MidiFile(object):
         self.charset = charset
         self.debug = debug
         self.clip = clip
+        # Optional function (index, name) -> bool choosing which tracks
+        # to decode. The others are loaded as UndecodedTrack.
+        self.load_tracks = load_tracks
 
         self.tracks = []
 
@@ -331,24 +566,48 @@ class MidiFile(object):
 
     def _load(self, infile):
         if self.debug:
-            infile = DebugFileWrapper(infile)
+            self._load_debug(DebugFileWrapper(infile))
+            return
+
+        # Read the whole file at once and decode it from memory.
+        data = bytearray(infile.read())
 
         with meta_charset(self.charset):
-            if self.debug:
-                _dbg('Header:')
+            (self.type,
+             num_tracks,
+             self.ticks_per_beat), pos = _decode_file_header(data)
+
+            if self.load_tracks is None:
+                for i in range(num_tracks):
+                    track, pos = decode_track(data, pos, clip=self.clip)
+                    self.tracks.append(track)
+                return
+
+            directory = decode_track_directory(data, pos, num_tracks)
+            for i, (offset, size, name) in enumerate(directory):
+                if self.load_tracks(i, name):
+                    track, pos = decode_track(data, offset, clip=self.clip)
+                else:
+                    track = UndecodedTrack(name,
+                                           bytes(data[offset:offset + 8 + size]),
+                                           charset=self.charset,
+                                           clip=self.clip)
+                self.tracks.append(track)
+
+    def _load_debug(self, infile):
+        with meta_charset(self.charset):
+            _dbg('Header:')
 
             (self.type,
              num_tracks,
              self.ticks_per_beat) = read_file_header(infile)
 
-            if self.debug:
-                _dbg('-> type={}, tracks={}, ticks_per_beat={}'.format(
-                    self.type, num_tracks, self.ticks_per_beat))
-                _dbg()
+            _dbg('-> type={}, tracks={}, ticks_per_beat={}'.format(
+                self.type, num_tracks, self.ticks_per_beat))
+            _dbg()
 
             for i in range(num_tracks):
-                if self.debug:
-                    _dbg('Track {}:'.format(i))
+                _dbg('Track {}:'.format(i))
 
                 self.tracks.append(read_track(infile,
                                               debug=self.debug,
@@ -444,7 +703,10 @@ class MidiFile(object):
             write_chunk(outfile, b'MThd', header)
 
             for track in self.tracks:
-                write_track(outfile, track)
+                if isinstance(track, UndecodedTrack):
+                    outfile.write(track.data)
+                else:
+                    write_track(outfile, track)
 
     def print_tracks(self, meta_only=False):
         """Prints out all messages in a .midi file.
@@ -466,7 +728,8 @@ class MidiFile(object):
     def __repr__(self):
         return '<midi file {!r} type {}, {} tracks, {} messages>'.format(
             self.filename, self.type, len(self.tracks),
-            sum([len(track) for track in self.tracks]))
+            sum([len(track) for track in self.tracks
+                 if not isinstance(track, UndecodedTrack)]))
 
     # The context manager has no purpose but is kept around since it was
     # used in examples in the past.